@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import data_processing
+from data_processing import (
+    get_multiples, get_revenue, get_deal_size, get_valuation, get_runway,
+    get_exit_stats, get_equity_stats, get_results, coerce_metrics
+)
+
+BASELINE_PATH = os.getenv('BENCHMARK_BASELINE', 'benchmark_baseline.json')
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+# A stage is reported as a regression when it is this much slower than the baseline
+REGRESSION_THRESHOLD = 1.2
+
+# Rough shape of a PitchBook deals export
+DEAL_TYPES = {
+    'Early Stage VC': 0.30, 'Later Stage VC': 0.20, 'Seed Round': 0.15, 'Angel (individual)': 0.05,
+    'Merger/Acquisition': 0.08, 'Buyout/LBO': 0.04, 'IPO': 0.02, 'Secondary Transaction - Private': 0.03,
+    'Add-on': 0.04, 'Debt - General': 0.05, 'Grant': 0.03, 'Corporate': 0.01,
+}
+DEAL_TYPES_2 = {
+    'Seed': 0.20, 'Series A': 0.18, 'Series B': 0.14, 'Series C': 0.10, 'Series D': 0.06,
+    'Series D1': 0.02, 'Series E': 0.03, 'Add-on': 0.05, 'Bonds': 0.02, 'Recapitalization': 0.02,
+    'Acquisition Financing': 0.02, 'Corporate Divestiture': 0.01, None: 0.15,
+}
+# Share of missing values in each metric column
+MISSING_RATE = {
+    'valuation_by_revenue': 0.85, 'revenue': 0.7, 'deal_size': 0.3, 'post_valuation': 0.6, 'percent_acquired': 0.8,
+}
+
+def choice(rng, weights, size):
+    labels = list(weights)
+    p = np.array(list(weights.values()), dtype=float)
+    return np.array(labels, dtype=object)[rng.choice(len(labels), size=size, p=p / p.sum())]
+
+def generate_deals(n_rows, seed=0):
+    # Synthetic deals table: 1-10 deals per company numbered from 1, dates increasing per
+    # company, and metric columns as numeric strings with 'NaT' for missing values, the
+    # way they were stored before typed columns
+    rng = np.random.default_rng(seed)
+    deals_per_company = rng.integers(1, 11, size=n_rows)
+    company_index = np.repeat(np.arange(len(deals_per_company)), deals_per_company)[:n_rows]
+    starts = np.flatnonzero(np.r_[True, company_index[1:] != company_index[:-1]])
+    deal_no = np.arange(n_rows) - np.repeat(starts, np.diff(np.r_[starts, n_rows])) + 1
+
+    first_deal = np.datetime64('2005-01-01') + rng.integers(0, 365 * 15, size=len(deals_per_company)).astype('timedelta64[D]')
+    gaps = rng.gamma(2.0, 300, size=n_rows).astype('int64')
+    gaps[starts] = 0
+    offsets = np.cumsum(gaps) - np.repeat(np.cumsum(gaps)[starts], np.diff(np.r_[starts, n_rows]))
+
+    df = pd.DataFrame({
+        'company_id': 'C' + pd.Series(company_index).astype(str),
+        'deal_no_': deal_no,
+        'deal_type': choice(rng, DEAL_TYPES, n_rows),
+        'deal_type_2': choice(rng, DEAL_TYPES_2, n_rows),
+        'deal_date': pd.to_datetime(first_deal[company_index] + offsets.astype('timedelta64[D]')),
+    })
+    scales = {'valuation_by_revenue': 10, 'revenue': 20, 'deal_size': 15, 'post_valuation': 80, 'percent_acquired': 0.3}
+    for col, scale in scales.items():
+        values = rng.lognormal(0, 1, size=n_rows) * scale
+        if col == 'percent_acquired':
+            values = np.clip(values, 0, 1) * 100
+        strings = np.round(values, 2).astype(str).astype(object)
+        strings[rng.random(n_rows) < MISSING_RATE[col]] = 'NaT'
+        df[col] = strings
+    return df
+
+def measure(func, arg, setup=None):
+    # Wall time from an untraced run, peak memory from a second, traced one: tracemalloc
+    # slows allocation-heavy stages by an order of magnitude, so it must not be timed.
+    # setup, when given, runs before each of the two runs.
+    if setup:
+        setup()
+    start = time.perf_counter()
+    func(arg)
+    seconds = time.perf_counter() - start
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(seconds, 4), 'peak_mb': round(peak / 1024 ** 2, 1)}
+
+def clear_metric_cache():
+    shutil.rmtree(data_processing.CACHE_DIR, ignore_errors=True)
+    os.makedirs(data_processing.CACHE_DIR)
+
+def run(n_rows):
+    df = generate_deals(n_rows)
+    coerced = coerce_metrics(df.copy())
+    stages = {
+        # coerce_metrics converts in place, so each run gets its own copy
+        'coerce_metrics': (lambda frame: coerce_metrics(frame.copy()), df),
+        'get_multiples': (get_multiples, coerced[['deal_type', 'deal_type_2', 'valuation_by_revenue']]),
+        'get_revenue': (get_revenue, coerced[['deal_type', 'deal_type_2', 'revenue']]),
+        'get_deal_size': (get_deal_size, coerced[['deal_type', 'deal_type_2', 'deal_size']]),
+        'get_valuation': (get_valuation, coerced[['deal_type', 'deal_type_2', 'post_valuation']]),
+        'get_exit_stats': (get_exit_stats, coerced[['deal_type', 'post_valuation']]),
+        'get_equity_stats': (get_equity_stats, coerced[['deal_type', 'deal_type_2', 'percent_acquired']]),
+        'get_runway': (get_runway, coerced[['company_id', 'deal_no_', 'deal_type_2', 'deal_date']]),
+        # Full main aggregation from the raw string columns, without the metric cache
+        'get_results': (lambda frame: get_results(frame, use_cache=False), df),
+        # Metric cache emptied before each run, then runs where every metric is a hit
+        'get_results_cache_cold': (lambda frame: get_results(frame, use_cache=True), df, clear_metric_cache),
+        'get_results_cache_warm': (lambda frame: get_results(frame, use_cache=True), df),
+    }
+    cache_dir = data_processing.CACHE_DIR
+    data_processing.CACHE_DIR = tempfile.mkdtemp(prefix='benchmark_cache_')
+    try:
+        # Stages run in order, so the cold stage leaves the cache filled for the warm stage
+        return {name: measure(*stage) for name, stage in stages.items()}
+    finally:
+        shutil.rmtree(data_processing.CACHE_DIR, ignore_errors=True)
+        data_processing.CACHE_DIR = cache_dir
+
+def compare(results, baseline):
+    regressions = []
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            previous = baseline.get(size, {}).get(stage)
+            if not previous:
+                continue
+            ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else float('inf')
+            print(f"{size:>10} {stage:<22} {result['seconds']:>9.3f}s vs {previous['seconds']:>9.3f}s ({ratio:.2f}x)")
+            if ratio > REGRESSION_THRESHOLD:
+                regressions.append(f"{stage} at {size} rows")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data_processing on synthetic deal tables")
+    parser.add_argument('sizes', nargs='*', type=int, default=DEFAULT_SIZES, help="row counts to benchmark")
+    parser.add_argument('--save-baseline', action='store_true', help=f"write the results to {BASELINE_PATH}")
+    args = parser.parse_args()
+
+    results = {}
+    for n_rows in args.sizes:
+        print(f"Benchmarking {n_rows} rows...")
+        results[str(n_rows)] = run(n_rows)
+        for stage, result in results[str(n_rows)].items():
+            print(f"  {stage:<22} {result['seconds']:>9.3f}s  {result['peak_mb']:>8.1f} MB peak")
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return 0
+
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        print("\nCompared to baseline:")
+        regressions = compare(results, baseline)
+        if regressions:
+            print(f"\nSlower than {REGRESSION_THRESHOLD}x baseline: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
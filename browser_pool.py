@@ -0,0 +1,129 @@
+import os
+import queue
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import TimeoutException, NoSuchElementException
+
+# Number of headless Chrome sessions that may load pages at the same time
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 4))
+# Seconds a page may take to load before the text rendered so far is used
+BROWSER_PAGE_TIMEOUT = float(os.getenv('BROWSER_PAGE_TIMEOUT', 20))
+BROWSER_IMPLICIT_WAIT = float(os.getenv('BROWSER_IMPLICIT_WAIT', 10))
+# Sessions are restarted after this many pages to bound Chrome's memory growth
+BROWSER_MAX_PAGES = int(os.getenv('BROWSER_MAX_PAGES', 50))
+
+def new_driver(page_timeout=BROWSER_PAGE_TIMEOUT, implicit_wait=BROWSER_IMPLICIT_WAIT):
+    options = webdriver.ChromeOptions()
+    options.add_argument('--ignore-certificate-errors')
+    options.add_argument('--headless=new')
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(page_timeout)
+    driver.implicitly_wait(implicit_wait)
+    return driver
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        # The session may already be gone after a crash
+        pass
+
+class BrowserPool:
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES, driver_factory=new_driver):
+        # driver_factory: returns a WebDriver-like object; sessions are started lazily
+        self.size = size
+        self.max_pages = max_pages
+        self.driver_factory = driver_factory
+        self.slots = threading.BoundedSemaphore(size)
+        # Idle sessions as [driver, pages loaded]
+        self.idle = queue.LifoQueue()
+        self.closed = False
+
+    def checkout(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return [self.driver_factory(), 0]
+
+    def checkin(self, session):
+        if self.closed or session[1] >= self.max_pages:
+            quit_driver(session[0])
+        else:
+            self.idle.put(session)
+
+    def load_text(self, driver, url):
+        try:
+            driver.get(url)
+        except TimeoutException:
+            # Keep whatever rendered before the timeout instead of failing the page
+            driver.execute_script("window.stop();")
+        try:
+            return driver.find_element(By.XPATH, "/html/body").text
+        except NoSuchElementException:
+            # Not a crash: the page simply has no body
+            return ""
+
+    def fetch_text(self, url):
+        if self.closed:
+            raise RuntimeError("Browser pool is closed")
+        with self.slots:
+            session, loaded = None, False
+            try:
+                session = self.checkout()
+                try:
+                    text = self.load_text(session[0], url)
+                except Exception as e:
+                    # A crashed or wedged session is replaced and the page retried once. When
+                    # chromedriver itself died the error comes from urllib3, not selenium.
+                    print(f"Browser session failed on {url} ({e.__class__.__name__}), restarting it")
+                    quit_driver(session[0])
+                    session = None
+                    session = [self.driver_factory(), 0]
+                    text = self.load_text(session[0], url)
+                loaded = True
+            finally:
+                # Only sessions that just loaded a page go back to the pool; any other is quit
+                # so its Chrome process cannot leak
+                if session is not None:
+                    if loaded:
+                        session[1] += 1
+                        self.checkin(session)
+                    else:
+                        quit_driver(session[0])
+            return text
+
+    def fetch_many(self, urls):
+        # Texts in the order of urls, loaded concurrently up to the pool size
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(self.fetch_text, urls))
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                driver, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            quit_driver(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool():
+    # Shared pool so every scrape in the process reuses the same Chrome sessions
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = BrowserPool()
+            atexit.register(_pool.close)
+        return _pool
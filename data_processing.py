@@ -1,19 +1,99 @@
 import os
+import re
+import glob
+import json
+import html
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow.feather as feather
 import folium
-import matplotlib.pyplot as plt
-from sqlalchemy import create_engine
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-from geopy.exc import GeocoderTimedOut
+from folium.plugins import FastMarkerCluster
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from sqlalchemy import create_engine, text, bindparam, inspect
+from geocoding import get_geocoder
+from quantile_sketch import GroupedQuantileSketch
+from results_export import export_results, unique_names
+from instrumentation import span
+from llm_cache import cached_chat_completion
 from openai import OpenAI
 from credentials import OPENAI_API_KEY, DATABASE_URL
 
 pd.options.mode.chained_assignment = None  # default='warn'
-def get_multiples(df):
-    # Convert 'valuation_by_revenue' to numeric values, replacing 'NaT' with NaN
-    df['valuation_by_revenue'] = pd.to_numeric(df['valuation_by_revenue'], errors='coerce')
 
+# Metrics reported as medians per 'deal_type' and per 'deal_type_2'
+METRIC_COLUMNS = ['valuation_by_revenue', 'revenue', 'deal_size', 'post_valuation', 'percent_acquired']
+# Columns read from the deals table by main
+REPORT_COLUMNS = ['company_id', 'deal_no_', 'deal_type', 'deal_type_2', 'deal_date'] + METRIC_COLUMNS
+SOURCE_FILE = 'test_1'
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# Local Arrow snapshots of get_dataframe results, keyed by query and table version
+USE_CACHE = os.getenv('DEALS_CACHE', '1').lower() in ('1', 'true', 'yes')
+CACHE_DIR = os.getenv('DEALS_CACHE_DIR', '.deals_cache')
+CACHE_MAX_BYTES = int(os.getenv('DEALS_CACHE_MAX_BYTES', 1024 ** 3))
+# Memoized metric results, stored next to the snapshots and keyed on their input columns
+USE_METRICS_CACHE = os.getenv('METRICS_CACHE', '1').lower() in ('1', 'true', 'yes')
+# 'cluster' renders one clustered layer, 'geojson' one GeoJSON layer, 'markers' a marker per location
+MAP_MODE = os.getenv('MAP_MODE', 'cluster')
+# 'pandas' computes medians locally, 'sql' computes them inside the database,
+# 'streaming' estimates them chunk by chunk without loading the whole table
+REPORT_BACKEND = os.getenv('REPORT_BACKEND', 'pandas')
+# Comma-separated source files for a batch run; 'per_source' writes a workbook per source,
+# 'single' one workbook with a pair of sheets per source
+BATCH_SOURCE_FILES = [source.strip() for source in os.getenv('REPORT_SOURCE_FILES', '').split(',') if source.strip()]
+BATCH_OUTPUT = os.getenv('REPORT_BATCH_OUTPUT', 'per_source')
+BATCH_WORKERS = int(os.getenv('REPORT_BATCH_WORKERS', 0)) or None
+# Companies drawn individually in the growth chart; larger portfolios are sampled
+GROWTH_CHART_MAX_COMPANIES = int(os.getenv('GROWTH_CHART_MAX_COMPANIES', 500))
+# Rows per chunk and relative error bound of the streaming medians
+STREAMING_CHUNK_SIZE = int(os.getenv('STREAMING_CHUNK_SIZE', 100000))
+STREAMING_RELATIVE_ACCURACY = float(os.getenv('STREAMING_RELATIVE_ACCURACY', 0.01))
+
+RUNWAY_EXCLUDED_DEAL_TYPES = [
+    'Acquisition Financing', 'Add-on', 'Bonds', 
+    'Corporate Divestiture',
+    'Recapitalization', 'Series D1'
+]
+# Exclusion profiles and percentiles evaluated by get_runway_profiles
+RUNWAY_PROFILES = {
+    'default': RUNWAY_EXCLUDED_DEAL_TYPES,
+}
+RUNWAY_PERCENTILES = {'p25': 0.25, 'median': 0.5, 'p75': 0.75}
+EXIT_DEAL_TYPES = [
+    'IPO', 'Buyout/LBO', 'Reverse Merger', 'Secondary Buyout',
+    'Merger/Acquisition', 'Secondary Transaction - Private', 'Share Repurchase'
+    , 'Secondary Transaction - Open Market', 'Public Investment 2nd Offering'
+]
+EXIT_DEAL_TYPE_RENAMES = {
+    'Secondary Transaction - Private': 'Secondary Offering',
+    'Secondary Transaction - Open Market': 'Secondary Offering',
+    'Public Investment 2nd Offering': 'Secondary Offering'
+}
+
+# Input columns of each metric; a metric is only recomputed when these change
+METRIC_INPUTS = {
+    'multiples': ['deal_type', 'deal_type_2', 'valuation_by_revenue'],
+    'revenue': ['deal_type', 'deal_type_2', 'revenue'],
+    'deal_size': ['deal_type', 'deal_type_2', 'deal_size'],
+    'valuation': ['deal_type', 'deal_type_2', 'post_valuation'],
+    'runway': ['company_id', 'deal_no_', 'deal_type_2', 'deal_date'],
+    'exit': ['deal_type', 'post_valuation'],
+    'equity': ['deal_type', 'deal_type_2', 'percent_acquired'],
+}
+# Median column behind each grouped metric
+MEDIAN_METRICS = {
+    'multiples': 'valuation_by_revenue',
+    'revenue': 'revenue',
+    'deal_size': 'deal_size',
+    'valuation': 'post_valuation',
+    'equity': 'percent_acquired',
+}
+
+def get_multiples(df):
     # Group by 'deal_type_1' and 'deal_type_2' and calculate the median of 'valuation_by_revenue'
     medians_1 = df.groupby('deal_type')['valuation_by_revenue'].median()
     medians_2 = df.groupby('deal_type_2')['valuation_by_revenue'].median()
@@ -22,9 +102,6 @@ def get_multiples(df):
     return medians_1, medians_2
 
 def get_revenue(df):
-    # Convert 'valuation_by_revenue' to numeric values, replacing 'NaT' with NaN
-    df['revenue'] = pd.to_numeric(df['revenue'], errors='coerce')
-
     # Group by 'deal_type_1' and 'deal_type_2' and calculate the median of 'revenue'
     medians_1 = df.groupby('deal_type')['revenue'].median()
     medians_2 = df.groupby('deal_type_2')['revenue'].median()
@@ -33,9 +110,6 @@ def get_revenue(df):
     return medians_1, medians_2
 
 def get_deal_size(df):
-    # Convert 'valuation_by_revenue' to numeric values, replacing 'NaT' with NaN
-    df['deal_size'] = pd.to_numeric(df['deal_size'], errors='coerce')
-
     # Group by 'deal_type_1' and 'deal_type_2' and calculate the median of 'valuation_by_revenue'
     medians_1 = df.groupby('deal_type')['deal_size'].median()
     medians_2 = df.groupby('deal_type_2')['deal_size'].median()
@@ -44,9 +118,6 @@ def get_deal_size(df):
     return medians_1, medians_2
 
 def get_valuation(df):
-    # Convert 'valuation_by_revenue' to numeric values, replacing 'NaT' with NaN
-    df['post_valuation'] = pd.to_numeric(df['post_valuation'], errors='coerce')
-
     # Group by 'deal_type_1' and 'deal_type_2' and calculate the median of 'valuation_by_revenue'
     medians_1 = df.groupby('deal_type')['post_valuation'].median()
     medians_2 = df.groupby('deal_type_2')['post_valuation'].median()
@@ -54,70 +125,110 @@ def get_valuation(df):
     # Return both sets of medians as a tuple
     return medians_1, medians_2
 
-def get_runway(df):
-    exclude_deal_types = [
-        'Acquisition Financing', 'Add-on', 'Bonds', 
-        'Corporate Divestiture', 'NaT', 
-        'Recapitalization', 'Series D1'
-    ]
-
-    # Convert 'Deal Date' to datetime format if not already
-    df['deal_date'] = pd.to_datetime(df['deal_date'])
+def get_runway(df, exclude_deal_types=RUNWAY_EXCLUDED_DEAL_TYPES):
+    # Median years to the next deal, for a single exclusion profile
+    runway = get_runway_profiles(df, {'runway': exclude_deal_types}, {'median': 0.5})
+    return runway[('runway', 'median')].rename('Time to Next Deal')
 
-    # Filter out the rows with excluded deal types
-    df = df[~df['deal_type_2'].isin(exclude_deal_types)]
+def get_runway_profiles(df, profiles=RUNWAY_PROFILES, percentiles=RUNWAY_PERCENTILES):
+    # Years to each company's next deal per 'deal_type_2', for every exclusion profile
+    # and percentile; columns are (profile, percentile name)
+    df = df[df['deal_type_2'].notna()]
 
-    # Sort by 'Company ID' and 'Deal No.'
+    # Sort by 'Company ID' and 'Deal No.' once; each profile is a mask over the sorted rows,
+    # and masking keeps the order, so nothing is re-sorted per profile
     df = df.sort_values(by=['company_id', 'deal_no_'])
-
-    # Calculate the time difference between consecutive deals for each company
-    df['Next Deal Date'] = df.groupby('company_id')['deal_date'].shift(-1)
-    df['Time to Next Deal'] = (df['Next Deal Date'] - df['deal_date']).dt.days
-
-    # Group by 'Deal Type 2' and calculate the median time difference
-    median_runway = df.groupby('deal_type_2')['Time to Next Deal'].median() / 365
-
-    return median_runway
+    company_ids = df['company_id'].to_numpy()
+    has_company = df['company_id'].notna().to_numpy()
+    deal_dates = df['deal_date'].to_numpy()
+    deal_types = df['deal_type_2'].to_numpy()
+
+    results = {}
+    for name, exclude_deal_types in profiles.items():
+        keep = ~df['deal_type_2'].isin(exclude_deal_types).to_numpy()
+        ids, known, dates, types = company_ids[keep], has_company[keep], deal_dates[keep], deal_types[keep]
+
+        days = next_deal_days(ids, known, dates)
+        gaps = pd.DataFrame({'deal_type_2': types, 'Time to Next Deal': days})
+        quantiles = gaps.groupby('deal_type_2')['Time to Next Deal'].quantile(list(percentiles.values())).unstack()
+        quantiles = quantiles.reindex(columns=list(percentiles.values()))
+        quantiles.columns = list(percentiles.keys())
+        results[name] = quantiles / 365
+
+    return pd.concat(results, axis=1)
+
+def next_deal_days(ids, known, dates):
+    # Days to the following row's deal, unless that row starts another company;
+    # rows must be sorted by company and deal number
+    same_company = known[:-1] & known[1:] & (ids[:-1] == ids[1:])
+    next_dates = np.full(len(dates), np.datetime64('NaT'), dtype=dates.dtype)
+    next_dates[:-1] = np.where(same_company, dates[1:], np.datetime64('NaT'))
+    return pd.Series(next_dates - dates).dt.days
 
 # Geocoding function
 def geocode_city(city_name):
-    try:
-        geolocator = Nominatim(user_agent="vrs-comps")
-        location = geolocator.geocode(city_name)
-        if location:
-            return location.latitude, location.longitude
-        else:
-            return None, None
-    except GeocoderTimedOut:
-        return None, None
-
-def map_cities(cities):
+    return get_geocoder().geocode(city_name)
+
+def aggregate_locations(cities, geocoder=None):
+    # cities has one entry per company; returns (latitude, longitude) -> cities and company count
+    counts = Counter(city.strip() for city in cities if isinstance(city, str) and city.strip())
+    locations = (geocoder or get_geocoder()).geocode_many(counts)
+
+    points = {}
+    for city, (latitude, longitude) in locations.items():
+        if latitude is None or longitude is None:
+            continue
+        # Different spellings of a city geocode to the same point
+        point = points.setdefault((round(latitude, 4), round(longitude, 4)), {'cities': [], 'companies': 0})
+        point['cities'].append(city)
+        point['companies'] += counts[city]
+    return points
+
+def map_cities(cities, geocoder=None, mode=MAP_MODE, output_file='map.html'):
+    # cities: company city per company (repeats are counted), e.g. one per company_id
     world_map = folium.Map(location=[20, 0], zoom_start=2)  # Center of the map
-
-    # Add a marker for each city
-    for city in cities:
-        latitude, longitude = geocode_city(city)
-        if latitude is not None and longitude is not None:
-            folium.Marker([latitude, longitude], popup=city).add_to(world_map)
-
-    world_map.save('map.html')
+    points = aggregate_locations(cities, geocoder)
+
+    def popup(point):
+        return f"{html.escape(', '.join(point['cities']))}: {point['companies']} companies"
+
+    if mode == 'cluster':
+        # One compact data array clustered in the browser, instead of a Python-built marker per city
+        callback = """
+        function (row) {
+            var marker = L.marker(new L.LatLng(row[0], row[1]));
+            marker.bindPopup(row[2]);
+            return marker;
+        }
+        """
+        data = [[latitude, longitude, popup(point)] for (latitude, longitude), point in points.items()]
+        FastMarkerCluster(data, callback=callback).add_to(world_map)
+    elif mode == 'geojson':
+        features = [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                'properties': {'cities': ', '.join(point['cities']), 'companies': point['companies']},
+            }
+            for (latitude, longitude), point in points.items()
+        ]
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            marker=folium.CircleMarker(radius=4, fill=True),
+            popup=folium.GeoJsonPopup(fields=['cities', 'companies']),
+        ).add_to(world_map)
+    elif mode == 'markers':
+        # Add a marker for each location
+        for (latitude, longitude), point in points.items():
+            folium.Marker([latitude, longitude], popup=popup(point)).add_to(world_map)
+    else:
+        raise ValueError(f"Unknown map mode: {mode}")
+
+    world_map.save(output_file)
 
 def get_exit_stats(df):
-    # Convert 'valuation_by_revenue' to numeric values, replacing 'NaT' with NaN
-    exit_deal_types = [
-        'IPO', 'Buyout/LBO', 'Reverse Merger', 'Secondary Buyout',
-        'Merger/Acquisition', 'Secondary Transaction - Private', 'Share Repurchase'
-        , 'Secondary Transaction - Open Market', 'Public Investment 2nd Offering'
-    ]
-    df = df[df['deal_type'].isin(exit_deal_types)]
-    df = df[~df['deal_type'].isin(['NaT'])]
-    df['deal_type'] = df['deal_type'].replace({
-        'Secondary Transaction - Private': 'Secondary Offering',
-        'Secondary Transaction - Open Market': 'Secondary Offering',
-        'Public Investment 2nd Offering': 'Secondary Offering'
-    })
-
-    df['post_valuation'] = pd.to_numeric(df['post_valuation'], errors='coerce')
+    df = df[df['deal_type'].isin(EXIT_DEAL_TYPES)]
+    df['deal_type'] = df['deal_type'].replace(EXIT_DEAL_TYPE_RENAMES)
 
     # Group by 'Deal Type 2' and calculate the median time difference
     median_valuation = df.groupby('deal_type')['post_valuation'].median()
@@ -125,67 +236,408 @@ def get_exit_stats(df):
     return median_valuation
 
 def get_equity_stats(df):
-    # Convert 'valuation_by_revenue' to numeric values, replacing 'NaT' with NaN
-    df['percent_acquired'] = pd.to_numeric(df['percent_acquired'], errors='coerce')
-
     # Group by 'Deal Type 2' and calculate the median time difference
     median_equity_1 = df.groupby('deal_type')['percent_acquired'].median()
     median_equity_2 = df.groupby('deal_type_2')['percent_acquired'].median()
 
     return median_equity_1, median_equity_2
 
-# Does not work as well as intended
-# Could use a lot of work
-# Ignoring this for now
-def get_growth_chart(df):
-    # Assuming 'deal_date' is in a recognizable date format
-    df['deal_date'] = pd.to_datetime(df['deal_date'])
-    df = df.sort_values(by=['company_id', 'deal_date'])
-    df = df.dropna(subset=['deal_size'])
-    df['deal_size'] = pd.to_numeric(df['deal_size'], errors='coerce')
+def coerce_metrics(df, columns=METRIC_COLUMNS):
+    # Convert metric columns to numeric once; typed columns from the database are left as is
+    for col in columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+def get_results(df, use_cache=USE_METRICS_CACHE):
+    # Coerce every metric column once, then compute all medians in one grouped pass per key.
+    # With use_cache, metrics whose input columns are unchanged are read back instead.
+    results, fingerprints = {}, {}
+    if use_cache:
+        with span('metric_cache_lookup', rows=len(df)):
+            # Settings that change a metric's output are part of its fingerprint
+            settings = {'runway': RUNWAY_EXCLUDED_DEAL_TYPES, 'exit': [EXIT_DEAL_TYPES, EXIT_DEAL_TYPE_RENAMES]}
+            # Each input column is hashed once and its digest shared by every metric that reads it
+            digests = column_digests(df, {col for columns in METRIC_INPUTS.values() for col in columns})
+            for name, columns in METRIC_INPUTS.items():
+                fingerprints[name] = fingerprint(digests, columns, settings.get(name))
+                cached = read_metric(name, fingerprints[name])
+                if cached is not None:
+                    results[name] = cached
+    missing = [name for name in METRIC_INPUTS if name not in results]
+
+    # A run where every median and exit stat is cached skips coercion entirely
+    if any(name in MEDIAN_METRICS or name == 'exit' for name in missing):
+        with span('coerce_metrics', rows=len(df)):
+            metrics = coerce_metrics(df[['deal_type', 'deal_type_2'] + METRIC_COLUMNS])
+
+    median_columns = [MEDIAN_METRICS[name] for name in missing if name in MEDIAN_METRICS]
+    if median_columns:
+        with span('grouped_medians', rows=len(metrics)):
+            medians_1 = metrics.groupby('deal_type')[median_columns].median()
+            medians_2 = metrics.groupby('deal_type_2')[median_columns].median()
+        for name in missing:
+            if name in MEDIAN_METRICS:
+                results[name] = (medians_1[MEDIAN_METRICS[name]], medians_2[MEDIAN_METRICS[name]])
+    if 'exit' in missing:
+        with span('exit_stats', rows=len(metrics)):
+            results['exit'] = get_exit_stats(metrics[['deal_type', 'post_valuation']])
+    if 'runway' in missing:
+        with span('runway', rows=len(df)):
+            results['runway'] = get_runway(df[['company_id', 'deal_no_', 'deal_type_2', 'deal_date']])
+
+    if use_cache:
+        for name in missing:
+            write_metric(name, fingerprints[name], results[name])
+        hits = [name for name in METRIC_INPUTS if name not in missing]
+        print(f"Metric cache hits: {', '.join(hits) or 'none'}; recomputed: {', '.join(missing) or 'none'}")
+
+    medians_1 = pd.concat([results[name][0] for name in MEDIAN_METRICS], axis=1)
+    medians_2 = pd.concat([results[name][1] for name in MEDIAN_METRICS], axis=1)
+    return combine_results(medians_1, medians_2, results['exit'], results['runway'])
+
+def combine_results(medians_1, medians_2, exit_stats, runway):
+    # Same column layout as the per-metric functions: exit stats and runway sit before equity
+    result_1 = pd.concat([medians_1[col] for col in METRIC_COLUMNS[:-1]] + [exit_stats, medians_1['percent_acquired']], axis=1)
+    result_2 = pd.concat([medians_2[col] for col in METRIC_COLUMNS[:-1]] + [runway, medians_2['percent_acquired']], axis=1)
+    return result_1, result_2
+
+def get_growth_chart(df, output_file='growth_chart.png', max_companies=GROWTH_CHART_MAX_COMPANIES, bin_years=0.5, seed=0):
+    # Writes the normalized funding trajectories to output_file (.png or .svg) without a display.
+    # Above max_companies a random sample of companies is drawn; the median trajectory
+    # line is always computed from every company, binned every bin_years.
+    df = df.dropna(subset=['company_id', 'deal_date', 'deal_size'])
 
     # Normalize the deal date by subtracting each company's first deal date
-    df['Normalized Deal Date'] = df.groupby('company_id')['deal_date'].transform(lambda x: (x - x.min()))
-
-    # Plot setup
-    plt.figure(figsize=(12, 6))
-    plt.xlabel('Years Since First Deal')
-    plt.ylabel('Deal Size')
-    plt.title('Normalized Startup Funding Trajectory')
-
-    # Group by company and plot each company's normalized trajectory
-    for company_name, group in df.groupby('companies'):
-        # Convert normalized deal date to years for plotting
-        years_since_first_deal = group['Normalized Deal Date'].dt.days / 365.25
-        plt.plot(years_since_first_deal, group['deal_size'], marker='o', label=company_name)
-
-    plt.legend()
-    plt.show()
+    years = (df['deal_date'] - df.groupby('company_id')['deal_date'].transform('min')).dt.days / 365.25
+    df = df.assign(years_since_first_deal=years).sort_values(by=['company_id', 'deal_date'])
+
+    # Median deal size per bin of years since the first deal, over all companies
+    bins = (df['years_since_first_deal'] // bin_years) * bin_years
+    median_trajectory = df.groupby(bins)['deal_size'].median()
+
+    shown = df
+    companies = df['company_id'].unique()
+    if len(companies) > max_companies:
+        sample = np.random.default_rng(seed).choice(companies, max_companies, replace=False)
+        shown = df[df['company_id'].isin(sample)]
+
+    # One polyline per company, split where the (sorted) company id changes
+    points = shown[['years_since_first_deal', 'deal_size']].to_numpy(dtype=float)
+    ids = shown['company_id'].to_numpy()
+    segments = np.split(points, np.flatnonzero(ids[1:] != ids[:-1]) + 1) if len(points) else []
+
+    # Figure is used directly instead of pyplot, so no GUI backend is involved
+    figure = Figure(figsize=(12, 6))
+    axes = figure.add_subplot()
+    axes.add_collection(LineCollection(segments, linewidths=0.8, alpha=0.4))
+    axes.scatter(points[:, 0], points[:, 1], s=4, alpha=0.4)
+    axes.plot(median_trajectory.index, median_trajectory.to_numpy(), color='black', linewidth=2, label='Median')
+    axes.autoscale()
+    axes.set_xlabel('Years Since First Deal')
+    axes.set_ylabel('Deal Size')
+    title = 'Normalized Startup Funding Trajectory'
+    if len(companies) > max_companies:
+        title += f' ({max_companies} of {len(companies)} companies)'
+    axes.set_title(title)
+    axes.legend()
+    figure.savefig(output_file)
+    return output_file
 
 def extract_company_names(df):
     company_names = df['companies'].unique().tolist()
     return company_names
 
-def get_dataframe():
+def build_conditions(source_files=None, start_date=None, end_date=None, deal_types=None):
+    # WHERE conditions, bound parameters and the names of list parameters that need expanding
+    conditions = []
+    params = {}
+    expanding = []
+    if source_files is not None:
+        conditions.append("source_file IN :source_files")
+        params['source_files'] = [source_files] if isinstance(source_files, str) else list(source_files)
+        expanding.append('source_files')
+    if deal_types is not None:
+        conditions.append("deal_type IN :deal_types")
+        params['deal_types'] = [deal_types] if isinstance(deal_types, str) else list(deal_types)
+        expanding.append('deal_types')
+    if start_date is not None:
+        conditions.append("deal_date >= :start_date")
+        params['start_date'] = pd.Timestamp(start_date).to_pydatetime()
+    if end_date is not None:
+        conditions.append("deal_date <= :end_date")
+        params['end_date'] = pd.Timestamp(end_date).to_pydatetime()
+    return conditions, params, expanding
+
+def build_query(table_name, columns=None, source_files=None, start_date=None, end_date=None, deal_types=None, distinct=False, order_by=None):
+    # Identifiers cannot be bound as parameters, so only plain column names are accepted
+    for name in [table_name] + list(columns or []) + list(order_by or []):
+        if not IDENTIFIER.match(name):
+            raise ValueError(f"Invalid column or table name: {name}")
+
+    select = ', '.join(columns) if columns else '*'
+    conditions, params, expanding = build_conditions(source_files, start_date, end_date, deal_types)
+
+    query = f"SELECT {'DISTINCT ' if distinct else ''}{select} FROM {table_name}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if order_by:
+        query += " ORDER BY " + ", ".join(order_by)
+    query = text(query).bindparams(*[bindparam(name, expanding=True) for name in expanding])
+    return query, params
+
+def hash_key(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()[:16]
+
+def source_key(source_files):
+    if source_files is None:
+        return hash_key(None)
+    return hash_key(sorted([source_files] if isinstance(source_files, str) else source_files))
+
+def get_table_version(engine, table_name, source_files):
+    # Row count and last load time; any insert, update or delete by tembo changes one of them.
+    # None for tables loaded before tembo added loaded_at, whose updates cannot be detected
+    if 'loaded_at' not in {column['name'] for column in inspect(engine).get_columns(table_name)}:
+        return None
+    conditions, params, expanding = build_conditions(source_files)
+    query = f"SELECT count(*), max(loaded_at) FROM {table_name}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query = text(query).bindparams(*[bindparam(name, expanding=True) for name in expanding])
+    with engine.connect() as connection:
+        row_count, loaded_at = connection.execute(query, params).one()
+    return f"{row_count}:{loaded_at}"
+
+def column_digests(df, columns):
+    # Content hash of each column, independent of the row index
+    return {col: hashlib.sha256(pd.util.hash_pandas_object(df[col], index=False).to_numpy().tobytes()).hexdigest()
+            for col in columns}
+
+def fingerprint(digests, columns, *settings):
+    return hash_key([digests[col] for col in columns], columns, settings)
+
+def read_metric(name, key):
+    path = os.path.join(CACHE_DIR, f"metric_{name}_{key}.pkl")
+    # Batch workers prune concurrently, so the file may go away at any point
+    try:
+        os.utime(path)
+        return pd.read_pickle(path)
+    except FileNotFoundError:
+        return None
+
+def write_metric(name, key, result):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"metric_{name}_{key}.pkl")
+    # Workers computing the same metric each write their own temp file; the last replace wins
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pd.to_pickle(result, temp_path)
+    os.replace(temp_path, path)
+    prune_cache()
+
+def invalidate_cache(source_files=None):
+    # Remove the snapshots for the given source files, or every snapshot and memoized metric
+    prefix = source_key(source_files) if source_files is not None else ''
+    for path in glob.glob(os.path.join(CACHE_DIR, f"{prefix}*.arrow")):
+        os.remove(path)
+    if source_files is None:
+        for path in glob.glob(os.path.join(CACHE_DIR, "metric_*.pkl")):
+            os.remove(path)
+
+def prune_cache(max_bytes=CACHE_MAX_BYTES):
+    # Evict least recently used snapshots and metrics until the cache fits in max_bytes
+    # Batch workers prune concurrently, so any file may already be gone
+    entries = []
+    for path in glob.glob(os.path.join(CACHE_DIR, "*.arrow")) + glob.glob(os.path.join(CACHE_DIR, "*.pkl")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def read_cached(engine, query, params, table_name, source_files):
+    # Snapshot name: <source files>_<query>_<table version>.arrow
+    table_version = get_table_version(engine, table_name, source_files)
+    if table_version is None:
+        print(f"{table_name} has no loaded_at column; reading it without the snapshot cache")
+        return pd.read_sql_query(query, engine, params=params)
+    query_prefix = f"{source_key(source_files)}_{hash_key(str(query), params)}"
+    version = hash_key(table_version)
+    path = os.path.join(CACHE_DIR, f"{query_prefix}_{version}.arrow")
+
+    try:
+        os.utime(path)
+        # Uncompressed Arrow files are memory mapped instead of read into memory
+        return feather.read_table(path, memory_map=True).to_pandas()
+    except FileNotFoundError:
+        pass
+
+    df = pd.read_sql_query(query, engine, params=params)
+
+    # Older versions of this query are stale now
+    for stale in glob.glob(os.path.join(CACHE_DIR, f"{query_prefix}_*.arrow")):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    feather.write_feather(df, temp_path, compression='uncompressed')
+    os.replace(temp_path, path)
+    prune_cache()
+    return df
+
+def stream_query(engine, query, params, chunksize):
+    # Server-side cursor, so only one chunk is held in memory at a time
+    with engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        yield from pd.read_sql_query(query, connection, params=params, chunksize=chunksize)
+
+def get_dataframe(columns=None, source_files=SOURCE_FILE, start_date=None, end_date=None, deal_types=None, distinct=False, chunksize=None, use_cache=USE_CACHE, order_by=None):
+    # columns: columns to read (all when None); source_files: one or more source_file values
+    # start_date/end_date: inclusive deal_date bounds; deal_types: allowed 'deal_type' values
+    # chunksize: return an iterator of DataFrames instead of a single one (not cached)
+    # order_by: columns to sort by in the database
+    # use_cache: reuse the local snapshot while the source's table version is unchanged
     table_name = 'deals'
-    source_file = 'test_1'
     if not DATABASE_URL:
         raise ValueError("Database connection string not found in environment variables")
 
     try:
         engine = create_engine(DATABASE_URL)
-        query = f"SELECT * FROM {table_name} where source_file='{source_file}'"
-        df = pd.read_sql_query(query, engine)
+        query, params = build_query(table_name, columns, source_files, start_date, end_date, deal_types, distinct, order_by)
+        if chunksize is not None:
+            return stream_query(engine, query, params, chunksize)
+        if use_cache:
+            return read_cached(engine, query, params, table_name, source_files)
+        df = pd.read_sql_query(query, engine, params=params)
         return df
 
         # company_names = extract_company_names(df)
-        # growth_chart = get_growth_chart(df[['company_id', 'companies', 'deal_no_', 'deal_type_2', 'deal_date', 'deal_size', 'revenue']])
+        # growth_chart = get_growth_chart(df[['company_id', 'deal_date', 'deal_size']])
 
     except Exception as e:
         print(f"An error occurred: {e}")
         return pd.DataFrame()  # Return an empty DataFrame in case of an error
     
 
+def get_results_streaming(chunks, relative_accuracy=STREAMING_RELATIVE_ACCURACY):
+    # Approximate get_results over an iterable of REPORT_COLUMNS chunks, keeping only
+    # mergeable quantile sketches in memory. Every median is within relative_accuracy
+    # of the exact one. Chunks must arrive sorted by company_id, deal_no_ for runway.
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+
+    def sketch():
+        return GroupedQuantileSketch(relative_accuracy)
+
+    sketches = {key: {col: sketch() for col in METRIC_COLUMNS} for key in ('deal_type', 'deal_type_2')}
+    exit_sketch = sketch()
+    runway_sketch = sketch()
+    # Last runway row of the previous chunk; its next deal may be in the current chunk
+    carry = None
+
+    for chunk in chunks:
+        metrics = coerce_metrics(chunk[['deal_type', 'deal_type_2'] + METRIC_COLUMNS])
+        for key, key_sketches in sketches.items():
+            for col, col_sketch in key_sketches.items():
+                col_sketch.add(metrics[key], metrics[col])
+
+        exits = metrics[metrics['deal_type'].isin(EXIT_DEAL_TYPES)]
+        exit_sketch.add(exits['deal_type'].replace(EXIT_DEAL_TYPE_RENAMES), exits['post_valuation'])
+
+        rows = chunk[chunk['deal_type_2'].notna() & ~chunk['deal_type_2'].isin(RUNWAY_EXCLUDED_DEAL_TYPES)]
+        rows = rows[['company_id', 'deal_type_2', 'deal_date']]
+        if carry is not None:
+            rows = pd.concat([carry, rows])
+        if rows.empty:
+            continue
+        days = next_deal_days(rows['company_id'].to_numpy(), rows['company_id'].notna().to_numpy(), rows['deal_date'].to_numpy())
+        runway_sketch.add(rows['deal_type_2'].to_numpy()[:-1], days.to_numpy()[:-1])
+        carry = rows.iloc[-1:]
+
+    if carry is not None:
+        # The very last deal has no next deal
+        runway_sketch.add(carry['deal_type_2'].to_numpy(), [np.nan])
+
+    medians_1, medians_2 = [
+        pd.DataFrame({col: col_sketch.median() for col, col_sketch in sketches[key].items()}).rename_axis(key)
+        for key in ('deal_type', 'deal_type_2')
+    ]
+    exit_stats = exit_sketch.median().rename_axis('deal_type').rename('post_valuation')
+    runway = (runway_sketch.median() / 365).rename_axis('deal_type_2').rename('Time to Next Deal')
+    return combine_results(medians_1, medians_2, exit_stats, runway)
+
+def read_sql_medians(engine, query, params, expanding, key):
+    query = text(query).bindparams(*[bindparam(name, expanding=True) for name in expanding])
+    df = pd.read_sql_query(query, engine, params=params)
+    # Database collations order keys differently from pandas, so sort locally
+    return df.set_index(key).sort_index()
+
+def get_results_sql(engine, source_files=SOURCE_FILE, table_name='deals'):
+    # Same tables as get_results, with medians and runway computed in the database.
+    # Works on Postgres and on embedded engines such as DuckDB.
+    conditions, params, expanding = build_conditions(source_files)
+    where = " AND ".join(conditions) if conditions else "TRUE"
+
+    medians = ", ".join(f"percentile_cont(0.5) WITHIN GROUP (ORDER BY {col}) AS {col}" for col in METRIC_COLUMNS)
+    medians_1, medians_2 = [
+        read_sql_medians(
+            engine,
+            f"SELECT {key}, {medians} FROM {table_name} WHERE {where} AND {key} IS NOT NULL GROUP BY {key}",
+            params, expanding, key
+        )
+        for key in ('deal_type', 'deal_type_2')
+    ]
+
+    # Exit stats: keep exit deal types and fold the secondary offerings together
+    renames = " ".join(f"WHEN :rename_{i} THEN :renamed_{i}" for i in range(len(EXIT_DEAL_TYPE_RENAMES)))
+    exit_params = dict(params, exit_deal_types=EXIT_DEAL_TYPES)
+    for i, (name, renamed) in enumerate(EXIT_DEAL_TYPE_RENAMES.items()):
+        exit_params[f'rename_{i}'] = name
+        exit_params[f'renamed_{i}'] = renamed
+    exit_stats = read_sql_medians(
+        engine,
+        f"""
+        SELECT deal_type, percentile_cont(0.5) WITHIN GROUP (ORDER BY post_valuation) AS post_valuation
+        FROM (
+            SELECT CASE deal_type {renames} ELSE deal_type END AS deal_type, post_valuation
+            FROM {table_name} WHERE {where} AND deal_type IN :exit_deal_types
+        ) exits
+        GROUP BY deal_type
+        """,
+        exit_params, expanding + ['exit_deal_types'], 'deal_type'
+    )['post_valuation']
+
+    # Runway: days to each company's next deal, ordered by deal number like get_runway
+    runway_params = dict(params, exclude_deal_types=RUNWAY_EXCLUDED_DEAL_TYPES)
+    runway = read_sql_medians(
+        engine,
+        f"""
+        WITH gaps AS (
+            SELECT deal_type_2,
+                CASE WHEN company_id IS NOT NULL THEN
+                    floor(extract(epoch FROM (lead(deal_date) OVER (PARTITION BY company_id ORDER BY deal_no_) - deal_date)) / 86400)
+                END AS days
+            FROM {table_name}
+            WHERE {where} AND deal_type_2 IS NOT NULL AND deal_type_2 NOT IN :exclude_deal_types
+        )
+        SELECT deal_type_2, percentile_cont(0.5) WITHIN GROUP (ORDER BY days) / 365 AS runway
+        FROM gaps GROUP BY deal_type_2
+        """,
+        runway_params, expanding + ['exclude_deal_types'], 'deal_type_2'
+    )['runway'].rename('Time to Next Deal')
+
+    return combine_results(medians_1, medians_2, exit_stats, runway)
+
 def interpret_results(results):
     # Convert the results DataFrame to a string
     client = OpenAI(api_key=OPENAI_API_KEY)
@@ -194,8 +646,9 @@ def interpret_results(results):
     Summarize the results for average valuation, revenue, deal size, valuation by revenue, 
     runway and equity percentage for series A stage companies as given in the data"""
 
-    # Use the OpenAI API to generate an interpretation
-    response = client.chat.completions.create(
+    # Use the OpenAI API to generate an interpretation; identical prompts are served from the cache
+    interpretation = cached_chat_completion(
+          client,
           model="gpt-4",
           messages=[
               {
@@ -204,45 +657,92 @@ def interpret_results(results):
               }
           ]
       )
-    print(response.choices[0].message.content.strip())
-    return response.choices[0].message.content.strip()
+    print(interpretation)
+    return interpretation
 
 def main():
 
-    df = get_dataframe()
     print("Calculating results... \n")
-    multiples = get_multiples(df[['deal_type', 'deal_type_2', 'valuation_by_revenue']])
-    print("Multiples done")
-    revenue = get_revenue(df[['deal_type', 'deal_type_2', 'revenue']])
-    print("Revenue done")
-    deal_size = get_deal_size(df[['deal_type', 'deal_type_2', 'deal_size']])
-    print("Deal size done")
-    valuation = get_valuation(df[['deal_type', 'deal_type_2', 'post_valuation']])
-    print("Valuation done")
-    runway = get_runway(df[['company_id', 'deal_no_', 'deal_type_2', 'deal_date']])
-    print("Runway done")
-    exit_stats = get_exit_stats(df[['deal_type', 'post_valuation']])
-    print("Exit stats done")
-    equity_stats = get_equity_stats(df[['deal_type', 'deal_type_2', 'percent_acquired']])
-    print("Equity stats done")
-
-    result_1 = pd.concat([multiples[0], revenue[0], deal_size[0], valuation[0], exit_stats, equity_stats[0]], axis=1)
-    result_2 = pd.concat([multiples[1], revenue[1], deal_size[1], valuation[1], runway, equity_stats[1]], axis=1)
-    
-    print("\nSaving results to Excel...")
-    with pd.ExcelWriter('results.xlsx') as writer:
-        result_2.to_excel(writer, sheet_name='Fundraising', index=True)
-        result_1.to_excel(writer, sheet_name='Exit', index=True)
-    print("Results saved to Excel \n")
+    if REPORT_BACKEND not in ('pandas', 'sql', 'streaming'):
+        raise ValueError(f"Unknown report backend: {REPORT_BACKEND}")
+    if REPORT_BACKEND == 'sql':
+        with span('get_results_sql'):
+            result_1, result_2 = get_results_sql(create_engine(DATABASE_URL))
+    elif REPORT_BACKEND == 'streaming':
+        with span('get_results_streaming'):
+            chunks = get_dataframe(columns=REPORT_COLUMNS, chunksize=STREAMING_CHUNK_SIZE, order_by=['company_id', 'deal_no_'])
+            result_1, result_2 = get_results_streaming(chunks)
+    else:
+        with span('get_dataframe') as stage:
+            df = get_dataframe(columns=REPORT_COLUMNS)
+            stage.rows = len(df)
+        with span('get_results', rows=len(df)):
+            result_1, result_2 = get_results(df)
+    print("Results done")
+
+    print("\nSaving results...")
+    with span('export', rows=len(result_1) + len(result_2)):
+        paths = export_results({'Fundraising': result_2, 'Exit': result_1})
+    print(f"Results saved to {', '.join(paths)} \n")
 
     # Call the function with your results
     # interpret_results(result_1)
     print("Interpreting results...")
-    interpret_results(result_2)
+    with span('interpret_results'):
+        interpret_results(result_2)
             
-    # world_map = map_cities(df['company_city'].unique().tolist())
+    # world_map = map_cities(df.drop_duplicates('company_id')['company_city'].tolist())
     # company_names = extract_company_names(df)
-    # growth_chart = get_growth_chart(df[['company_id', 'companies', 'deal_no_', 'deal_type_2', 'deal_date', 'deal_size', 'revenue']])
+    # growth_chart = get_growth_chart(df[['company_id', 'deal_date', 'deal_size']])
+
+def get_source_results(partition):
+    # Runs in a worker process
+    source_file, df = partition
+    return source_file, get_results(df)
+
+def run_batch(source_files=BATCH_SOURCE_FILES, output=BATCH_OUTPUT, max_workers=BATCH_WORKERS):
+    # Load every source with one query, then compute each source's tables in a process pool
+    if output not in ('per_source', 'single'):
+        raise ValueError(f"Unknown batch output: {output}")
+
+    with span('get_dataframe') as stage:
+        df = get_dataframe(columns=REPORT_COLUMNS + ['source_file'], source_files=source_files)
+        stage.rows = len(df)
+    # get_dataframe returns an empty frame without columns when the query failed
+    if df.empty or 'source_file' not in df.columns:
+        print(f"No deals loaded for: {', '.join(source_files)}; nothing to report")
+        return {}
+    partitions = [(source_file, group.drop(columns='source_file')) for source_file, group in df.groupby('source_file')]
+    missing = set(source_files) - {source_file for source_file, _ in partitions}
+    if missing:
+        print(f"No deals found for: {', '.join(sorted(missing))}")
+
+    print(f"Calculating results for {len(partitions)} sources... \n")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = dict(pool.map(get_source_results, partitions))
+    print("Results done")
+
+    print("\nSaving results...")
+    rows = sum(len(result_1) + len(result_2) for result_1, result_2 in results.values())
+    with span('export', rows=rows):
+        paths = []
+        if output == 'single':
+            sheets = {}
+            # Sheet names are limited to 31 characters; sources sharing their first 19 still get distinct sheets
+            labels = unique_names(results, 19)
+            for label, (result_1, result_2) in zip(labels, results.values()):
+                sheets[f"{label} Fundraising"] = result_2
+                sheets[f"{label} Exit"] = result_1
+            paths += export_results(sheets, 'results_batch')
+        else:
+            # Sources that differ only in characters safe_name replaces still get their own file
+            for stem, (result_1, result_2) in zip(unique_names(results), results.values()):
+                paths += export_results({'Fundraising': result_2, 'Exit': result_1}, f"results_{stem}")
+    print(f"Results saved to {len(paths)} files \n")
+    return results
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if BATCH_SOURCE_FILES:
+        run_batch()
+    else:
+        main()
\ No newline at end of file
@@ -4,7 +4,7 @@ from main import get_company_info
 from sqlalchemy import create_engine
 import json
 
-df = get_dataframe()
+df = get_dataframe(columns=['companies'], distinct=True)
 
 
 def generate_document(company_name, competitors_info, output_file):
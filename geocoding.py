@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from geopy.geocoders import Nominatim
+from geopy.extra.rate_limiter import RateLimiter
+from geopy.exc import GeocoderServiceError
+
+# On-disk cache of city -> [latitude, longitude], or null when the city was not found
+GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', 'geocode_cache.json')
+# Nominatim's usage policy allows one request per second
+GEOCODE_MIN_DELAY = float(os.getenv('GEOCODE_MIN_DELAY', 1.0))
+GEOCODE_WORKERS = int(os.getenv('GEOCODE_WORKERS', 4))
+
+# Returned by lookup when the backend failed; unlike "not found" it is not cached
+FAILED = object()
+
+class Geocoder:
+    def __init__(self, backend=None, cache_path=GEOCODE_CACHE_PATH, min_delay_seconds=GEOCODE_MIN_DELAY, max_workers=GEOCODE_WORKERS):
+        # backend: anything with geopy's geocode(query) interface; defaults to one shared Nominatim client
+        self.backend = backend or Nominatim(user_agent="vrs-comps")
+        # geopy's RateLimiter is thread-safe, so the delay holds across all workers. By default it
+        # returns None once its retries are used up, which would be cached as "not found"; with
+        # swallow_exceptions=False the error reaches lookup and the city is retried next run
+        self.rate_limited_geocode = RateLimiter(self.backend.geocode, min_delay_seconds=min_delay_seconds, max_retries=2,
+                                                swallow_exceptions=False)
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.cache = self.load()
+
+    def load(self):
+        if self.cache_path and os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                return json.load(f)
+        return {}
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            contents = json.dumps(self.cache, indent=2, sort_keys=True)
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(contents)
+        os.replace(temp_path, self.cache_path)
+
+    def lookup(self, city_name):
+        try:
+            location = self.rate_limited_geocode(city_name)
+        except GeocoderServiceError as e:
+            print(f"Geocoding failed for {city_name}: {e}")
+            return FAILED
+        if location:
+            return [location.latitude, location.longitude]
+        return None
+
+    def geocode_many(self, cities):
+        # Deduplicate, look up cache misses concurrently and return city -> (latitude, longitude),
+        # with (None, None) for cities that could not be found
+        names = list(dict.fromkeys(city.strip() for city in cities if isinstance(city, str) and city.strip()))
+        misses = [name for name in names if name not in self.cache]
+
+        if misses:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for name, result in zip(misses, pool.map(self.lookup, misses)):
+                    if result is not FAILED:
+                        with self.lock:
+                            self.cache[name] = result
+            self.save()
+
+        locations = {}
+        for name in names:
+            result = self.cache.get(name)
+            locations[name] = tuple(result) if result else (None, None)
+        return locations
+
+    def geocode(self, city_name):
+        return self.geocode_many([city_name]).get(city_name.strip(), (None, None))
+
+_geocoder = None
+
+def get_geocoder():
+    # Shared instance so every caller reuses one client and one cache
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = Geocoder()
+    return _geocoder
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import uuid
+import resource
+import tracemalloc
+
+# Per-stage timing and memory records, written as JSON lines when REPORT_TRACE is set
+TRACE_ENABLED = os.getenv('REPORT_TRACE', '').lower() in ('1', 'true', 'yes')
+TRACE_PATH = os.getenv('REPORT_TRACE_PATH', 'report_trace.jsonl')
+# tracemalloc slows allocation-heavy code noticeably, so it can be left off while tracing
+TRACE_MEMORY = os.getenv('REPORT_TRACE_MEMORY', '1').lower() in ('1', 'true', 'yes')
+
+RUN_ID = uuid.uuid4().hex[:12]
+
+class NoopSpan:
+    # Shared do-nothing span handed out while tracing is off
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NOOP_SPAN = NoopSpan()
+
+# Open spans, innermost last
+_open_spans = []
+
+class Span:
+    def __init__(self, stage, rows=None):
+        self.stage = stage
+        # May be set inside the with block once the row count is known
+        self.rows = rows
+        self.peak = 0
+        self.started_tracing = False
+
+    def __enter__(self):
+        if TRACE_MEMORY:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            elif _open_spans:
+                # The peak is about to be reset, so the enclosing span keeps what it reached so far
+                parent = _open_spans[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        _open_spans.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        _open_spans.remove(self)
+        record = {
+            'run_id': RUN_ID,
+            'stage': self.stage,
+            'timestamp': time.time(),
+            'seconds': round(seconds, 6),
+            'rows': self.rows,
+            'ok': exc_type is None,
+            # ru_maxrss is in kilobytes on Linux
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        if TRACE_MEMORY and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record['peak_traced_mb'] = round(self.peak / 1024 ** 2, 1)
+            if _open_spans:
+                # The enclosing span's peak includes this one's; its own measuring restarts here
+                parent = _open_spans[-1]
+                parent.peak = max(parent.peak, self.peak)
+                tracemalloc.reset_peak()
+            if self.started_tracing:
+                # Code outside any span runs untraced again
+                tracemalloc.stop()
+        with open(TRACE_PATH, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        return False
+
+def span(stage, rows=None):
+    # with span('runway', rows=len(df)) as s: ...
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    return Span(stage, rows)
+
+def enable(path=None, trace_memory=None):
+    global TRACE_ENABLED, TRACE_PATH, TRACE_MEMORY
+    TRACE_ENABLED = True
+    if path is not None:
+        TRACE_PATH = path
+    if trace_memory is not None:
+        TRACE_MEMORY = trace_memory
+
+def disable():
+    global TRACE_ENABLED
+    TRACE_ENABLED = False
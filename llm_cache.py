@@ -0,0 +1,76 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
+
+# Content-addressed cache of chat completions, keyed by model, messages and parameters
+LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', '.llm_cache')
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 30 * 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 100 * 1024 ** 2))
+# Skip cached answers (fresh answers are still stored)
+LLM_CACHE_BYPASS = os.getenv('LLM_CACHE_BYPASS', '').lower() in ('1', 'true', 'yes')
+
+def cache_key(model, messages, params):
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def read_entry(path, ttl):
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # Another writer or prune may remove the file at any point; that is a miss too
+    try:
+        if time.time() - entry['created'] > ttl:
+            os.remove(path)
+            return None
+        # Reads count as use for the LRU eviction
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return entry
+
+def prune(cache_dir=LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES):
+    # Evict least recently used entries until the cache fits in max_bytes
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, "*.json")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def cached_chat_completion(client, model, messages, bypass=LLM_CACHE_BYPASS, cache_dir=LLM_CACHE_DIR, ttl=LLM_CACHE_TTL,
+                           max_bytes=LLM_CACHE_MAX_BYTES, **params):
+    # Returns the stripped message content; API errors propagate and are never cached.
+    # client only needs chat.completions.create, so tests can pass a local fake.
+    key = cache_key(model, messages, params)
+    path = os.path.join(cache_dir, f"{key}.json")
+    if not bypass:
+        entry = read_entry(path, ttl)
+        if entry is not None:
+            return entry['content']
+
+    response = client.chat.completions.create(model=model, messages=messages, **params)
+    content = response.choices[0].message.content.strip()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Concurrent identical prompts each write their own temp file; the last replace wins
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({'created': time.time(), 'model': model, 'content': content}, f)
+    os.replace(temp_path, path)
+    prune(cache_dir, max_bytes)
+    return content
@@ -1,31 +1,44 @@
-from googleapiclient.discovery import build
 from credentials import ggl_api_key, ggl_cse_id, DRIVER_PATH, OPENAI_API_KEY
 from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
 from openai import OpenAI
+from llm_cache import cached_chat_completion
+from browser_pool import get_browser_pool
+from page_fetcher import get_fetcher
+from page_cache import cached_fetch
+from search_client import get_search_client, SEARCH_CONCURRENCY
+from concurrent.futures import ThreadPoolExecutor
 import os
+import json
 import time
+import threading
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Competitors researched at once, and per-service caps on requests in flight across all of them.
+# Page fetches are capped by FETCH_WORKERS and BROWSER_POOL_SIZE.
+COMPETITOR_WORKERS = int(os.getenv('COMPETITOR_WORKERS', 8))
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', 4))
+
+search_slots = threading.BoundedSemaphore(SEARCH_CONCURRENCY)
+llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+
+# Opt-in: ask for the about, customers and pricing summaries in one JSON-mode request per
+# competitor. JSON mode needs a model that supports response_format, which gpt-4 does not.
+STRUCTURED_SUMMARIES = os.getenv('STRUCTURED_SUMMARIES', '0').lower() in ('1', 'true', 'yes')
+STRUCTURED_SUMMARY_MODEL = os.getenv('STRUCTURED_SUMMARY_MODEL', 'gpt-4-turbo')
+SUMMARY_FIELDS = ['about', 'customers', 'pricing']
+
 def google_search(search_term, api_key, cse_id, **kwargs):
-    service = build("customsearch", "v1", developerKey=api_key)
-    res = service.cse().list(q=search_term, cx=cse_id, **kwargs).execute()
-    return res['items']
+    # Results are cached on disk and the daily query quota is tracked by the shared client
+    return get_search_client(api_key, cse_id).search(search_term, **kwargs)
   
 
 
-def scrape_dynamic_content(url, max_length=20000):
-    options = webdriver.ChromeOptions()
-    options.add_argument('--ignore-certificate-errors')
-    options.add_argument('--headless=new')
-    driver = webdriver.Chrome(options=options)
-
-    driver.get(url)
-    driver.implicitly_wait(10)
-    text_content = driver.find_element(By.XPATH, "/html/body").text
-    driver.quit()
+def scrape_dynamic_content(url, max_length=20000, pool=None):
+    # Pages are loaded in long-lived headless Chrome sessions shared across calls
+    # and the rendered text is kept in the shared page cache for PAGE_CACHE_TTL
+    pool = pool or get_browser_pool()
+    text_content = cached_fetch(url, lambda response: (pool.fetch_text(url), 'browser'), static=False)
 
     # Trim the content if it exceeds max_length
     if len(text_content) > max_length:
@@ -33,39 +46,119 @@ def scrape_dynamic_content(url, max_length=20000):
     else:
         return text_content
 
-def get_company_info(company_name, competitors):
-    company_info = {}
-
-    for competitor in competitors:
-        about_intro = f"Summarize the about section for {competitor} based on the following content and find why it's a competitor for {company_name}."
-        customers_intro = "Summarize the target customer(s) for the company based on the following content:"
-        pricing_intro = "Summarize the pricing information for the company based on the following content:"
-
-        # About
-        about_search_results = google_search(f"{competitor} About", ggl_api_key, ggl_cse_id, num=3)
-        about_content = ' '.join([scrape_dynamic_content(result['link'], max_length=20000) for result in about_search_results])
-        print(about_content)
-        about_summary = interpret_with_gpt(client, about_content, about_intro)
+def fetch_content(links, max_length=20000):
+    # Plain HTTP first, the headless browser only for pages that need rendering
+    texts = get_fetcher().fetch_many(links)
+    return ' '.join([text[:max_length] for text in texts])
+
+def search_links(query, num):
+    with search_slots:
+        return [result['link'] for result in google_search(query, ggl_api_key, ggl_cse_id, num=num)]
+
+def summarize(text, prompt_intro, **params):
+    with llm_slots:
+        return interpret_with_gpt(client, text, prompt_intro, **params)
+
+def summary_intros(company_name, competitor):
+    return {
+        'about': f"Summarize the about section for {competitor} based on the following content and find why it's a competitor for {company_name}.",
+        'customers': "Summarize the target customer(s) for the company based on the following content:",
+        'pricing': "Summarize the pricing information for the company based on the following content:"
+    }
+
+def structured_intro(company_name, competitor):
+    return f"""Answer the following about {competitor} based on the content below. Respond with a JSON object with exactly these string fields:
+"about": a summary of the about section for {competitor} and why it's a competitor for {company_name}
+"customers": a summary of the target customer(s) for the company
+"pricing": a summary of the pricing information for the company"""
+
+def parse_summaries(content):
+    # Keeps only the fields that came back as non-empty strings
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {field: data[field].strip() for field in SUMMARY_FIELDS if isinstance(data.get(field), str) and data[field].strip()}
+
+def summarize_structured(company_name, competitor, about_content, pricing_content):
+    # One JSON-mode request for all three summaries; a field that is missing or not a
+    # string is asked for on its own with the original prompt
+    bundle = f"About content:\n{about_content}\n\nPricing content:\n{pricing_content}"
+    response = summarize(bundle, structured_intro(company_name, competitor),
+                         model=STRUCTURED_SUMMARY_MODEL, response_format={"type": "json_object"})
+    summaries = parse_summaries(response)
+
+    intros = summary_intros(company_name, competitor)
+    contents = {'about': about_content, 'customers': about_content, 'pricing': pricing_content}
+    for field in SUMMARY_FIELDS:
+        if field not in summaries:
+            print(f"Structured summary for {competitor} has no valid '{field}', asking for it separately")
+            summaries[field] = summarize(contents[field], intros[field])
+    return {field: summaries[field] for field in SUMMARY_FIELDS}
+
+def research_about(competitor):
+    about_content = fetch_content(search_links(f"{competitor} About", 3), max_length=20000)
+    print(about_content)
+    return about_content
+
+def research_pricing(competitor):
+    pricing_content = fetch_content(search_links(f"{competitor} pricing", 1), max_length=20000)
+    print(pricing_content)
+    return pricing_content
+
+def research_competitor(company_name, competitor, branch_workers=3, structured=STRUCTURED_SUMMARIES):
+    intros = summary_intros(company_name, competitor)
+
+    if branch_workers <= 1:
+        # One step at a time, in the original order: about, customers, then pricing
+        about_content = research_about(competitor)
+        if structured:
+            return summarize_structured(company_name, competitor, about_content, research_pricing(competitor))
+        about_summary = summarize(about_content, intros['about'])
+        customers_summary = summarize(about_content, intros['customers'])
+        pricing_summary = summarize(research_pricing(competitor), intros['pricing'])
+        return {
+            'about': about_summary,
+            'customers': customers_summary,
+            'pricing': pricing_summary
+        }
 
-        # Customers
-        customers_summary = interpret_with_gpt(client, about_content, customers_intro)
+    # The pricing branch runs alongside the about branch, and both summaries of the
+    # about content are requested at the same time
+    with ThreadPoolExecutor(max_workers=branch_workers) as branches:
+        pricing_content = branches.submit(research_pricing, competitor)
+        about_content = research_about(competitor)
+        if structured:
+            return summarize_structured(company_name, competitor, about_content, pricing_content.result())
 
-        # Pricing
-        pricing_search_results = google_search(f"{competitor} pricing", ggl_api_key, ggl_cse_id, num=1)
-        pricing_content = ' '.join([scrape_dynamic_content(result['link'], max_length=20000) for result in pricing_search_results])
-        print(pricing_content)
-        pricing_summary = interpret_with_gpt(client, pricing_content, pricing_intro)
+        pricing_summary = branches.submit(lambda: summarize(pricing_content.result(), intros['pricing']))
+        customers_summary = branches.submit(summarize, about_content, intros['customers'])
+        about_summary = summarize(about_content, intros['about'])
 
-        # Store the results in the dictionary
-        company_info[competitor] = {
+        return {
             'about': about_summary,
-            'customers': customers_summary,
-            'pricing': pricing_summary
+            'customers': customers_summary.result(),
+            'pricing': pricing_summary.result()
         }
 
+def get_company_info(company_name, competitors, workers=COMPETITOR_WORKERS):
+    # Competitors are researched concurrently; searches, page fetches and GPT calls are
+    # each capped by their own limit. workers=1 runs them one after another.
+    if workers <= 1:
+        summaries = [research_competitor(company_name, competitor, branch_workers=1) for competitor in competitors]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(lambda competitor: research_competitor(company_name, competitor), competitors))
+
+    # Same dictionary the sequential loop built, including for repeated competitors
+    company_info = {}
+    for competitor, summary in zip(competitors, summaries):
+        company_info[competitor] = summary
     return company_info
 
-def interpret_with_gpt(client, text, prompt_intro, retries=3):
+def interpret_with_gpt(client, text, prompt_intro, retries=3, model="gpt-4", **params):
   print("\n")
   print(client)
   print("\n")
@@ -77,16 +170,18 @@ def interpret_with_gpt(client, text, prompt_intro, retries=3):
   full_prompt = f"{prompt_intro}\n\n{text}"
   for attempt in range(retries):
     try:
-      response = client.chat.completions.create(
-          model="gpt-4",
+      # Identical prompts are served from the on-disk cache
+      return cached_chat_completion(
+          client,
+          model=model,
           messages=[
               {
                   "role": "user",
                   "content": full_prompt
               }
-          ]
+          ],
+          **params
       )
-      return response.choices[0].message.content.strip()
     except Exception as e:
       if 'insufficient_quota' in str(e) and attempt < retries - 1:
         print(f"Quota exceeded, retrying in {2 ** attempt} seconds...")
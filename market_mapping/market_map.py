@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import google.generativeai as genai
 import json
@@ -12,6 +13,10 @@ import pandas as pd
 from sentence_transformers import SentenceTransformer, util
 from dotenv import load_dotenv
 
+# The page cache module lives at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from page_cache import cached_fetch
+
 load_dotenv()
 
 def configure():
@@ -22,27 +27,31 @@ def configure():
     
     genai.configure(api_key=api_key)
 
+def extract_website_text(response):
+    response.raise_for_status()
+
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    # Extract main content, remove scripts, styles and navigation
+    for script in soup(["script", "style", "nav", "header", "footer"]):
+        script.extract()
+
+    text = soup.get_text(separator=' ', strip=True)
+
+    # Basic clean up
+    text = " ".join(text.split())
+
+    return text
+
 def scrape_website(url):
-    """Scrape the content of a website."""
+    """Scrape the content of a website, reusing the shared page cache while the page is unchanged."""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Extract main content, remove scripts, styles and navigation
-        for script in soup(["script", "style", "nav", "header", "footer"]):
-            script.extract()
-            
-        text = soup.get_text(separator=' ', strip=True)
-        
-        # Basic clean up
-        text = " ".join(text.split())
-        
-        return text
+        def fetch(response):
+            if response is None:
+                raise requests.ConnectionError(f"No response from {url}")
+            return extract_website_text(response)
+
+        return cached_fetch(url, fetch, variant='main_text')
     except Exception as e:
         print(f"Error scraping website {url}: {e}")
         return None
@@ -0,0 +1,141 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
+import requests
+
+# Extracted page text shared by every scraper, keyed by URL; anchored next to this file so
+# scripts run from other directories (market_mapping/) use the same store
+PAGE_CACHE_DIR = os.getenv('PAGE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.page_cache'))
+# Entries younger than this are used without asking the server; older ones are revalidated,
+# or refetched when the browser rendered them
+PAGE_CACHE_TTL = float(os.getenv('PAGE_CACHE_TTL', 24 * 3600))
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', 200 * 1024 ** 2))
+PAGE_CACHE_TIMEOUT = float(os.getenv('PAGE_CACHE_TIMEOUT', 10))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+class PageCache:
+    def __init__(self, cache_dir=PAGE_CACHE_DIR, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def path(self, url, variant):
+        # variant separates texts extracted differently from the same page
+        key = hashlib.sha256(f"{variant}\n{url}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, url, variant='text'):
+        path = self.path(url, variant)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            # Reads count as use for the LRU eviction
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched'] <= self.ttl
+
+    def validators(self, entry):
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, text, headers=None, variant='text', entry=None, tier='static'):
+        # headers: response headers carrying the validators for the next revalidation.
+        # tier: 'static' when the text came from that response, 'browser' when it was rendered
+        headers = headers or {}
+        entry = dict(entry or {}, url=url, variant=variant, text=text, fetched=time.time())
+        entry.setdefault('tier', tier)
+        if headers:
+            entry['etag'] = headers.get('ETag')
+            entry['last_modified'] = headers.get('Last-Modified')
+        path = self.path(url, variant)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+        self.prune()
+
+    def prune(self):
+        # Evict least recently used entries until the store fits in max_bytes
+        with self.lock:
+            # Other processes share the directory and may remove entries at any point
+            entries = []
+            for path in glob.glob(os.path.join(self.cache_dir, "*.json")):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                total -= size
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+def default_request(url, headers):
+    return requests.get(url, headers={'User-Agent': USER_AGENT, **headers}, timeout=PAGE_CACHE_TIMEOUT, stream=True)
+
+def cached_fetch(url, fetch, variant='text', request=default_request, cache=None, static=True):
+    # fetch(response) -> text, or (text, tier), is called on a miss or when the page changed.
+    # response is the streamed reply to the (conditional) GET with its body still unread, or
+    # None if that request failed or was not sent. tier is 'static' (the default) when the
+    # text was extracted from response, 'browser' when the page was rendered instead.
+    # static: whether fetch wants the response on a miss; browser-only fetchers pass False so
+    # no HTTP request is made for them.
+    # request(url, headers) -> streamed response; lets callers use their own session.
+    cache = cache or get_page_cache()
+    entry = cache.get(url, variant)
+    if entry and cache.is_fresh(entry):
+        return entry['text']
+    if entry and entry.get('tier') == 'browser':
+        # Rendered text cannot be revalidated against the static HTML shell, which often
+        # stays unchanged while the rendered content does not, so it is refetched
+        entry = None
+
+    response = None
+    if static or entry is not None:
+        try:
+            response = request(url, cache.validators(entry))
+        except requests.RequestException:
+            response = None
+    try:
+        if response is not None and response.status_code == 304 and entry:
+            # Unchanged on the server: keep the text and restart its TTL
+            cache.put(url, entry['text'], variant=variant, entry=entry)
+            return entry['text']
+        result = fetch(response)
+    finally:
+        if response is not None:
+            response.close()
+
+    text, tier = result if isinstance(result, tuple) else (result, 'static')
+    # Failed or empty fetches are not cached, so the next run tries again
+    if text:
+        validators = response.headers if tier == 'static' and response is not None and response.ok else None
+        cache.put(url, text, validators, variant=variant, tier=tier)
+    return text
+
+_cache = None
+
+def get_page_cache():
+    global _cache
+    if _cache is None:
+        _cache = PageCache()
+    return _cache
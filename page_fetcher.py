@@ -0,0 +1,132 @@
+import os
+import json
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+from bs4 import FeatureNotFound
+from browser_pool import get_browser_pool
+from page_cache import cached_fetch
+
+# Static text shorter than this is taken to be a JavaScript-rendered page and refetched in the browser
+FETCH_MIN_TEXT_LENGTH = int(os.getenv('FETCH_MIN_TEXT_LENGTH', 500))
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', 10))
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 8))
+# Per-domain counts of which tier produced the text
+FETCH_STATS_PATH = os.getenv('FETCH_STATS_PATH', 'fetch_tiers.json')
+# Domains where the static tier failed this many times and never worked go straight to the browser
+FETCH_SKIP_STATIC_AFTER = int(os.getenv('FETCH_SKIP_STATIC_AFTER', 2))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+def new_session(pool_size=FETCH_WORKERS):
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def html_to_text(html):
+    # lxml is several times faster than html.parser when it is installed
+    try:
+        soup = BeautifulSoup(html, 'lxml')
+    except FeatureNotFound:
+        soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(["script", "style", "noscript", "template"]):
+        tag.extract()
+    return soup.get_text(separator='\n', strip=True)
+
+def domain(url):
+    return urlsplit(url).netloc.lower().removeprefix('www.')
+
+class TieredFetcher:
+    def __init__(self, session=None, browser_pool=None, stats_path=FETCH_STATS_PATH,
+                 min_text_length=FETCH_MIN_TEXT_LENGTH, max_workers=FETCH_WORKERS):
+        self.session = session or new_session(max_workers)
+        # Only started when a page actually needs rendering
+        self.browser_pool = browser_pool
+        self.stats_path = stats_path
+        self.min_text_length = min_text_length
+        self.max_workers = max_workers
+        # Caps HTTP requests in flight across concurrent fetch_many calls
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.lock = threading.Lock()
+        self.stats = self.load()
+
+    def load(self):
+        if self.stats_path and os.path.exists(self.stats_path):
+            with open(self.stats_path) as f:
+                return json.load(f)
+        return {}
+
+    def save(self):
+        if not self.stats_path:
+            return
+        # Held for the write too, since concurrent fetch_many calls share the temp file
+        with self.lock:
+            temp_path = f"{self.stats_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.stats, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.stats_path)
+
+    def record(self, url, tier):
+        with self.lock:
+            counts = self.stats.setdefault(domain(url), {'static': 0, 'browser': 0})
+            counts[tier] += 1
+
+    def skip_static(self, url):
+        counts = self.stats.get(domain(url), {})
+        return counts.get('static', 0) == 0 and counts.get('browser', 0) >= FETCH_SKIP_STATIC_AFTER
+
+    def request(self, url, headers):
+        with self.slots:
+            return self.session.get(url, headers=headers, timeout=FETCH_TIMEOUT, stream=True)
+
+    def fetch_static(self, url, response):
+        if response is None or not response.ok:
+            print(f"Static fetch failed for {url}: {'no response' if response is None else response.status_code}")
+            return ""
+        if 'html' not in response.headers.get('Content-Type', 'text/html'):
+            return ""
+        return html_to_text(response.text)
+
+    def fetch_browser(self, url):
+        pool = self.browser_pool or get_browser_pool()
+        return pool.fetch_text(url)
+
+    def fetch_tiers(self, url, response, static):
+        if static:
+            text = self.fetch_static(url, response)
+            if len(text) >= self.min_text_length:
+                self.record(url, 'static')
+                return text, 'static'
+        text = self.fetch_browser(url)
+        self.record(url, 'browser')
+        return text, 'browser'
+
+    def fetch_text(self, url):
+        # The cache's revalidation request doubles as the static tier's fetch; domains that
+        # only ever worked in the browser send no HTTP request at all
+        static = not self.skip_static(url)
+        return cached_fetch(url, lambda response: self.fetch_tiers(url, response, static), request=self.request, static=static)
+
+    def fetch_many(self, urls):
+        # Texts in the order of urls; browser fallbacks are still bounded by the browser pool
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            texts = list(executor.map(self.fetch_text, urls))
+        self.save()
+        return texts
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+def get_fetcher():
+    # Shared instance so every caller reuses one connection pool and one set of domain stats
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = TieredFetcher()
+        return _fetcher
@@ -0,0 +1,71 @@
+import math
+import numpy as np
+import pandas as pd
+
+class GroupedQuantileSketch:
+    """Mergeable per-group quantile sketch with a relative error bound (DDSketch).
+
+    Values are counted in logarithmic buckets, so any quantile estimate is within
+    relative_accuracy of the exact value (for groups whose values share a sign),
+    whatever the number of values added.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Counts indexed by (group, sign, bucket)
+        self.counts = pd.Series(dtype='int64')
+        # Every group seen, including groups whose values were all missing
+        self.groups = set()
+
+    def add(self, groups, values):
+        groups = pd.Series(np.asarray(groups, dtype=object))
+        values = pd.to_numeric(pd.Series(np.asarray(values)), errors='coerce').to_numpy(dtype=float)
+        known = groups.notna().to_numpy()
+        self.groups.update(groups[known].unique())
+
+        keep = known & np.isfinite(values)
+        groups, values = groups[keep].to_numpy(), values[keep]
+        if len(values) == 0:
+            return
+
+        signs = np.sign(values).astype('int64')
+        with np.errstate(divide='ignore'):
+            buckets = np.where(signs != 0, np.ceil(np.log(np.abs(values)) / self.log_gamma), 0).astype('int64')
+        counts = pd.DataFrame({'group': groups, 'sign': signs, 'bucket': buckets}).value_counts()
+        self.merge_counts(counts)
+
+    def merge_counts(self, counts):
+        if len(self.counts):
+            counts = self.counts.add(counts, fill_value=0)
+        self.counts = counts.astype('int64')
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        self.groups.update(other.groups)
+        if len(other.counts):
+            self.merge_counts(other.counts)
+
+    def quantile(self, q):
+        # Interpolates between neighbouring ranks like pandas' quantile/median;
+        # groups without values come back as NaN
+        results = {}
+        if len(self.counts):
+            for group, entries in self.counts.groupby(level=0):
+                signs = entries.index.get_level_values(1).to_numpy()
+                buckets = entries.index.get_level_values(2).to_numpy()
+                estimates = signs * 2 * self.gamma ** buckets.astype(float) / (self.gamma + 1)
+                order = np.argsort(estimates)
+                estimates = estimates[order]
+                cumulative = np.cumsum(entries.to_numpy()[order])
+
+                rank = q * (cumulative[-1] - 1)
+                lower = estimates[np.searchsorted(cumulative, math.floor(rank), side='right')]
+                upper = estimates[np.searchsorted(cumulative, math.ceil(rank), side='right')]
+                results[group] = lower + (rank - math.floor(rank)) * (upper - lower)
+        return pd.Series(results, dtype=float).reindex(sorted(self.groups))
+
+    def median(self):
+        return self.quantile(0.5)
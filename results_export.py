@@ -0,0 +1,93 @@
+import os
+import re
+import pandas as pd
+import xlsxwriter
+
+# 'xlsx' (streamed with xlsxwriter), 'csv', 'parquet' or 'json'
+EXPORT_FORMAT = os.getenv('REPORT_EXPORT_FORMAT', 'xlsx')
+NUMBER_FORMAT = '#,##0.00'
+
+def safe_name(name, max_length=None):
+    # Excel sheet names and file names cannot contain these characters
+    name = re.sub(r'[\\/*?:\[\]"<>|]', '_', str(name))
+    return name[:max_length] if max_length else name
+
+def unique_names(names, max_length=None):
+    # safe_name for each name, kept distinct after truncation (case-insensitively, as Excel
+    # compares sheet names); a name that would repeat an earlier one gets a "~2", "~3", ... suffix
+    used = set()
+    result = []
+    for name in names:
+        candidate, count = safe_name(name, max_length), 1
+        while candidate.lower() in used:
+            count += 1
+            suffix = f"~{count}"
+            candidate = safe_name(name, max_length - len(suffix) if max_length else None) + suffix
+        used.add(candidate.lower())
+        result.append(candidate)
+    return result
+
+def unique_columns(df):
+    # Parquet and JSON need unique column names; repeats get a '.1', '.2', ... suffix like pandas
+    seen = {}
+    columns = []
+    for col in df.columns:
+        count = seen.get(col, 0)
+        seen[col] = count + 1
+        columns.append(f"{col}.{count}" if count else str(col))
+    df = df.copy()
+    df.columns = columns
+    return df
+
+def cell(value):
+    # Blank cells for missing values, plain Python scalars for numpy ones
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+def write_xlsx(sheets, path):
+    # constant_memory flushes each row as it is written, so rows must go out strictly in
+    # order; DataFrame.to_excel writes column by column, hence the explicit row loop
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True})
+    number_format = workbook.add_format({'num_format': NUMBER_FORMAT})
+    try:
+        for sheet_name, df in sheets.items():
+            worksheet = workbook.add_worksheet(sheet_name)
+            index_names = [name or '' for name in df.index.names]
+            index_width = len(index_names)
+
+            # Column formats and the frozen header are set before any row is written
+            worksheet.set_column(0, index_width - 1, 28)
+            if len(df.columns):
+                worksheet.set_column(index_width, index_width + len(df.columns) - 1, 18, number_format)
+            worksheet.freeze_panes(1, index_width)
+
+            worksheet.write_row(0, 0, index_names + [str(col) for col in df.columns], header_format)
+            for row, (index, values) in enumerate(zip(df.index, df.itertuples(index=False, name=None)), start=1):
+                index_values = list(index) if index_width > 1 else [index]
+                worksheet.write_row(row, 0, [cell(value) for value in index_values + list(values)])
+    finally:
+        workbook.close()
+
+def export_results(sheets, stem='results', fmt=EXPORT_FORMAT):
+    # sheets: sheet name -> DataFrame. Writes <stem>.xlsx, or one <stem>_<sheet>.<fmt> file
+    # per sheet for the other formats. Returns the paths written.
+    if fmt == 'xlsx':
+        path = f"{stem}.xlsx"
+        write_xlsx(sheets, path)
+        return [path]
+
+    paths = []
+    for sheet_name, df in sheets.items():
+        path = f"{stem}_{safe_name(sheet_name).replace(' ', '_')}.{fmt}"
+        if fmt == 'csv':
+            df.to_csv(path, index=True)
+        elif fmt == 'parquet':
+            unique_columns(df).to_parquet(path, index=True)
+        elif fmt == 'json':
+            unique_columns(df).to_json(path, orient='split', indent=2)
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
+        paths.append(path)
+    return paths
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import queue
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from googleapiclient.discovery import build
+
+# On-disk cache of Custom Search results keyed by query, engine and parameters
+SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', 'search_cache.json')
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 7 * 24 * 3600))
+# Queries per day allowed by the API key (100 on the free tier); the count resets at
+# midnight Pacific time like Google's quota
+SEARCH_DAILY_QUOTA = int(os.getenv('SEARCH_DAILY_QUOTA', 100))
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+# Searches in flight at once; each holds one of this many long-lived discovery clients
+SEARCH_CONCURRENCY = int(os.getenv('SEARCH_CONCURRENCY', 4))
+
+class SearchQuotaExceeded(Exception):
+    pass
+
+def quota_day():
+    return datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+class SearchClient:
+    def __init__(self, api_key=None, cse_id=None, service=None, cache_path=SEARCH_CACHE_PATH,
+                 ttl=SEARCH_CACHE_TTL, daily_quota=SEARCH_DAILY_QUOTA, pool_size=SEARCH_CONCURRENCY):
+        # service: anything with the discovery client's cse().list(...).execute() interface,
+        # e.g. a local fake in tests; by default up to pool_size real clients are built and reused
+        self.api_key = api_key
+        self.cse_id = cse_id
+        self.service = service
+        self.pool_size = pool_size
+        self.services = queue.Queue()
+        self.built = 0
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.daily_quota = daily_quota
+        self.lock = threading.Lock()
+        state = self.load()
+        self.cache = state.get('results', {})
+        self.quota = state.get('quota', {'day': quota_day(), 'used': 0})
+
+    def load(self):
+        if self.cache_path and os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                return json.load(f)
+        return {}
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            now = time.time()
+            # Expired results are dropped whenever the file is rewritten
+            self.cache = {key: entry for key, entry in self.cache.items() if now - entry['fetched'] <= self.ttl}
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'results': self.cache, 'quota': self.quota}, f)
+            os.replace(temp_path, self.cache_path)
+
+    def checkout_service(self):
+        # Discovery clients share an httplib2 connection that is not thread-safe, so each
+        # search borrows one for itself; threads come and go, the clients stay
+        if self.service is not None:
+            return self.service
+        while True:
+            try:
+                return self.services.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                build_new = self.built < self.pool_size
+                if build_new:
+                    self.built += 1
+            if build_new:
+                break
+            # All clients are busy; recheck now and then in case a failed build freed a slot
+            try:
+                return self.services.get(timeout=1)
+            except queue.Empty:
+                pass
+        try:
+            return build("customsearch", "v1", developerKey=self.api_key)
+        except Exception:
+            with self.lock:
+                self.built -= 1
+            raise
+
+    def checkin_service(self, service):
+        if self.service is None:
+            self.services.put(service)
+
+    def reserve_query(self):
+        with self.lock:
+            today = quota_day()
+            if self.quota['day'] != today:
+                self.quota = {'day': today, 'used': 0}
+            if self.quota['used'] >= self.daily_quota:
+                raise SearchQuotaExceeded(f"Custom Search daily quota of {self.daily_quota} queries used up for {today}")
+            self.quota['used'] += 1
+
+    def remaining_quota(self):
+        with self.lock:
+            if self.quota['day'] != quota_day():
+                return self.daily_quota
+            return max(self.daily_quota - self.quota['used'], 0)
+
+    def search(self, query, **params):
+        key = json.dumps([query, self.cse_id, params], sort_keys=True)
+        with self.lock:
+            entry = self.cache.get(key)
+        if entry and time.time() - entry['fetched'] <= self.ttl:
+            return entry['items']
+
+        self.reserve_query()
+        service = self.checkout_service()
+        try:
+            res = service.cse().list(q=query, cx=self.cse_id, **params).execute()
+        finally:
+            self.checkin_service(service)
+        # Queries without results have no 'items' key
+        items = res.get('items', [])
+        with self.lock:
+            self.cache[key] = {'fetched': time.time(), 'items': items}
+        self.save()
+        return items
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_search_client(api_key, cse_id):
+    # One shared client per key and engine, so the cache and quota count are shared too
+    with _clients_lock:
+        if (api_key, cse_id) not in _clients:
+            _clients[(api_key, cse_id)] = SearchClient(api_key, cse_id)
+        return _clients[(api_key, cse_id)]
@@ -1,73 +1,340 @@
+import io
+import re
+import time
 import psycopg2
 import pandas as pd
+from openpyxl import load_workbook
 from psycopg2.extensions import AsIs
+from psycopg2.extras import execute_values
 import os
 
-# Function to replace NaT/NaN with None
-def replace_nan_nat_with_none(value):
-    if pd.isnull(value) or value is None:
-        return 'NaT'
-    return value
+# Rows sent to the database per COPY / execute_values call
+BATCH_SIZE = int(os.getenv('TEMBO_BATCH_SIZE', 50000))
+# 'copy' streams batches with COPY ... FROM STDIN, 'values' uses batched execute_values
+LOAD_METHOD = os.getenv('TEMBO_LOAD_METHOD', 'copy')
+# Rows read from the export and held in memory at a time
+CHUNK_SIZE = int(os.getenv('TEMBO_CHUNK_SIZE', 50000))
+# Incremental loads upsert on KEY_COLUMNS and skip rows whose row_hash is unchanged
+INCREMENTAL = os.getenv('TEMBO_INCREMENTAL', '').lower() in ('1', 'true', 'yes')
+KEY_COLUMNS = ['source_file', 'company_id', 'deal_no_']
+# Set by the database when a row is inserted or updated; readers use it to detect changes
+LOADED_AT_COLUMN = 'loaded_at TIMESTAMP DEFAULT now()'
 
-def main():
+# Postgres types and the expression used to migrate an old TEXT column to them.
+# Legacy rows stored nulls as the string 'NaT', which the guards turn into NULL.
+SQL_TYPES = {
+    'DOUBLE PRECISION': "CASE WHEN {col} ~ '^\\s*[-+]?([0-9]+\\.?[0-9]*|\\.[0-9]+)([eE][-+]?[0-9]+)?\\s*$' THEN {col}::double precision END",
+    'TIMESTAMP': "CASE WHEN {col} ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}}' THEN {col}::timestamp END",
+    'BOOLEAN': "CASE WHEN lower({col}) IN ('true', 'false') THEN {col}::boolean END",
+    'TEXT': "NULLIF({col}, 'NaT')",
+}
+# information_schema.columns.data_type for each of the types above
+INFORMATION_SCHEMA_TYPES = {
+    'double precision': 'DOUBLE PRECISION',
+    'timestamp without time zone': 'TIMESTAMP',
+    'boolean': 'BOOLEAN',
+    'bigint': 'BIGINT',
+    'text': 'TEXT',
+}
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+# Columns data_processing computes on as numbers and dates (medians, runway, SQL backend);
+# they keep their type, and values that do not fit are loaded as NULL with a warning
+REPORT_TYPED_COLUMNS = ['deal_no_', 'deal_date', 'valuation_by_revenue', 'revenue', 'deal_size', 'post_valuation', 'percent_acquired']
 
-     # Load the Excel file into a DataFrame
-    excel_file_path = 'tests/test_data_2.xlsx'  # Replace with the path to your Excel file
-    df = pd.read_excel(excel_file_path)
+def infer_sql_type(series):
+    values = series.dropna()
+    if values.empty:
+        return 'TEXT'
 
-    df = df.applymap(lambda x: None if pd.isna(x) else x)
-    df = df.applymap(replace_nan_nat_with_none)
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind == 'boolean':
+        return 'BOOLEAN'
+    if kind in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+        return 'DOUBLE PRECISION'
+    if kind in ('datetime', 'datetime64', 'date'):
+        return 'TIMESTAMP'
+    if kind == 'string':
+        # Text exports (CSV) keep dates as ISO strings
+        if values.map(lambda v: bool(ISO_DATE.match(v))).all() and pd.to_datetime(values, errors='coerce').notna().all():
+            return 'TIMESTAMP'
+    return 'TEXT'
 
+def coerce_chunk(df, column_types, keep_types=REPORT_TYPED_COLUMNS):
+    # Bring every chunk to the table's types. Returns the chunk and, per column, the number
+    # of non-null values that would not convert; such columns are left as read unless they
+    # are in keep_types, where those values become NULL
+    lost = {}
+    for col, sql_type in column_types.items():
+        if col not in df.columns:
+            continue
+        if sql_type == 'DOUBLE PRECISION':
+            coerced = pd.to_numeric(df[col], errors='coerce')
+        elif sql_type == 'TIMESTAMP':
+            coerced = pd.to_datetime(df[col], errors='coerce')
+        else:
+            continue
+        count = int((df[col].notna() & coerced.isna()).sum())
+        if count:
+            lost[col] = count
+        if not count or col in keep_types:
+            df[col] = coerced
+    return df, lost
+
+def widen_columns(conn, table_name, lost, column_types):
+    # Types are inferred from the first chunk; a later chunk with values of another kind
+    # turns the column into TEXT instead of loading those values as NULL
+    with conn.cursor() as cur:
+        for col, count in lost.items():
+            cur.execute(f"ALTER TABLE {table_name} ALTER COLUMN {col} TYPE TEXT USING {col}::text")
+            print(f"Widened column {col} from {column_types[col]} to TEXT: {count} values in this chunk are not {column_types[col]}")
+            column_types[col] = 'TEXT'
+        # The incremental staging table was created with the old column types
+        cur.execute(f"DROP TABLE IF EXISTS pg_temp.{table_name}_staging")
+    conn.commit()
+
+def clean_column_name(col):
+    # Clean up column names: replace spaces and periods with underscores.
+    # Lowercased to match how Postgres folds the unquoted identifiers.
+    return (str(col).replace(' ', '_',).replace('.', '_').replace('%','percent').replace('(','').replace(')','').replace(',','')
+    .replace('-','_').replace('/','_by_').replace('#','number').replace('&','and').lower())
+
+def read_header(header):
+    # Mirror pandas' naming of blank and duplicated header cells
+    columns = []
+    for i, col in enumerate(header):
+        name = f"Unnamed: {i}" if col is None else str(col)
+        candidate, count = name, 0
+        while candidate in columns:
+            count += 1
+            candidate = f"{name}.{count}"
+        columns.append(candidate)
+    return columns
+
+def read_chunks(file_path, chunk_size=CHUNK_SIZE):
+    # CSV exports can be streamed by pandas directly
+    if file_path.lower().endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=chunk_size)
+        return
+
+    # Read-only mode iterates rows lazily instead of loading the whole workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = read_header(header)
+
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+def clean_chunk(df, source_file):
     # Add an additional column for the Excel file identifier
-    excel_file_identifier = 'test_1'  # Replace with your identifier (e.g., filename)
-    df['source_file'] = excel_file_identifier
+    df['source_file'] = source_file
+    df.columns = [clean_column_name(col) for col in df.columns]
+    return df
 
-     # Clean up column names: replace spaces and periods with underscores
-    df.columns = [col.replace(' ', '_',).replace('.', '_').replace('%','percent').replace('(','').replace(')','').replace(',','')
-    .replace('-','_').replace('/','_by_').replace('#','number').replace('&','and') for col in df.columns]
+def copy_batch(cur, table_name, columns, batch):
+    # Serialize the batch as CSV in memory and stream it to the server
+    buffer = io.StringIO()
+    batch.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def execute_values_batch(cur, table_name, columns, batch):
+    insert_statement = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s"
+    # NaN/NaT are sent as real NULLs
+    batch = batch.astype(object).where(pd.notna(batch), None)
+    rows = list(batch.itertuples(index=False, name=None))
+    execute_values(cur, insert_statement, rows, page_size=len(rows))
+
+def bulk_insert(conn, df, table_name, batch_size=BATCH_SIZE, method=LOAD_METHOD):
+    if method not in ('copy', 'values'):
+        raise ValueError(f"Unknown load method: {method}")
+    loader = copy_batch if method == 'copy' else execute_values_batch
+    columns = list(df.columns)
+
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        for offset in range(0, len(df), batch_size):
+            loader(cur, table_name, columns, df.iloc[offset:offset + batch_size])
+            # Commit each batch so no single transaction spans the whole load
+            conn.commit()
+    return time.perf_counter() - start
+
+def get_column_types(cur, table_name):
+    cur.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s;",
+        (table_name,)
+    )
+    return {name: INFORMATION_SCHEMA_TYPES.get(data_type, 'TEXT') for name, data_type in cur.fetchall()}
+
+def ensure_table(conn, table_name, df, incremental=False):
+    # Create the table with inferred types, or migrate an existing one towards them
+    inferred_types = {col: infer_sql_type(df[col]) for col in df.columns}
+    inferred_types['source_file'] = 'TEXT'
+    if incremental:
+        inferred_types['row_hash'] = 'BIGINT'
+
+    with conn.cursor() as cur:
+        existing_types = get_column_types(cur, table_name)
+
+        if not existing_types:
+            # Construct the column definitions for the CREATE TABLE statement
+            column_definitions = ", ".join([f"{col} {sql_type}" for col, sql_type in inferred_types.items()] + [LOADED_AT_COLUMN])
+            create_table_statement = f"CREATE TABLE {table_name} ({column_definitions})"
+            cur.execute(create_table_statement)
+            print(f"Table {table_name} created")
+            column_types = inferred_types
+        else:
+            column_types = dict(existing_types)
+            for col, sql_type in inferred_types.items():
+                if col not in existing_types:
+                    cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} {sql_type}")
+                    column_types[col] = sql_type
+                    print(f"Added column {col} {sql_type}")
+                elif existing_types[col] == 'TEXT':
+                    # Legacy all-TEXT tables: convert the column and drop 'NaT' sentinels
+                    using = SQL_TYPES[sql_type].format(col=col)
+                    if sql_type == 'TEXT':
+                        cur.execute(f"UPDATE {table_name} SET {col} = {using} WHERE {col} = 'NaT'")
+                    else:
+                        cur.execute(f"ALTER TABLE {table_name} ALTER COLUMN {col} TYPE {sql_type} USING {using}")
+                        print(f"Migrated column {col} to {sql_type}")
+                    column_types[col] = sql_type
+            if 'loaded_at' not in existing_types:
+                cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {LOADED_AT_COLUMN}")
+
+        if incremental:
+            # ON CONFLICT needs a unique index on the key; this fails if earlier
+            # append-only loads already duplicated rows for a source_file
+            cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_key ON {table_name} ({', '.join(KEY_COLUMNS)})")
+        conn.commit()
+        return column_types
+
+def normalize_for_hash(df, column_types):
+    # The values as the table stores them, so a row hashes the same whichever dtype pandas
+    # gave it in a chunk (int64 3 and float64 3.0 in a DOUBLE PRECISION column, say)
+    normalized = {}
+    for col in df.columns:
+        sql_type = column_types.get(col, 'TEXT')
+        values = df[col]
+        if sql_type in ('DOUBLE PRECISION', 'BIGINT'):
+            values = pd.to_numeric(values, errors='coerce').astype('float64')
+        elif sql_type == 'TIMESTAMP':
+            values = pd.to_datetime(values, errors='coerce')
+        else:
+            values = values.astype(object).map(lambda v: None if pd.isna(v) else str(v))
+        normalized[col] = values
+    return pd.DataFrame(normalized, index=df.index)
+
+def prepare_incremental(df, column_types):
+    # Rows without a full key cannot be matched on a later run and are not loaded, and
+    # only the last copy of a key within a chunk is kept so ON CONFLICT touches each row once.
+    # Returns the chunk and the number of rows dropped for a missing key.
+    keyed = df.dropna(subset=KEY_COLUMNS)
+    missing_key = len(df) - len(keyed)
+    df = keyed.drop_duplicates(subset=KEY_COLUMNS, keep='last')
+
+    # Content hash over every loaded column
+    content_columns = [col for col in df.columns if col != 'row_hash']
+    row_hash = pd.util.hash_pandas_object(normalize_for_hash(df[content_columns], column_types), index=False)
+    df = df.assign(row_hash=row_hash.astype('int64'))
+    return df, missing_key
+
+def upsert_chunk(conn, df, table_name, method=LOAD_METHOD):
+    # Stage the chunk in a temporary table, then merge it into the target
+    staging_table = f"{table_name}_staging"
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging_table} (LIKE {table_name})")
+        cur.execute(f"TRUNCATE {staging_table}")
+    bulk_insert(conn, df, staging_table, method=method)
+
+    column_names = ', '.join(df.columns)
+    updates = ', '.join([f"{col} = EXCLUDED.{col}" for col in df.columns if col not in KEY_COLUMNS] + ["loaded_at = now()"])
+    # Unchanged rows fail the WHERE and are not written; xmax = 0 marks fresh inserts
+    upsert_statement = f"""
+        WITH upserted AS (
+            INSERT INTO {table_name} ({column_names})
+            SELECT {column_names} FROM {staging_table}
+            ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}
+            WHERE {table_name}.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+    """
+    with conn.cursor() as cur:
+        cur.execute(upsert_statement)
+        inserted, updated = cur.fetchone()
+    conn.commit()
+    return inserted, updated, len(df) - inserted - updated
+
+def main(excel_file_path='tests/test_data_2.xlsx', excel_file_identifier='test_1', table_name='deals', incremental=INCREMENTAL):
+    # excel_file_path: path to your Excel (or CSV) export
+    # excel_file_identifier: identifier stored in source_file (e.g., filename)
+    # incremental: upsert on (source_file, company_id, deal_no_) instead of appending
 
     # Connection string
     conn_str = os.getenv('DATABASE_URL')
     if not conn_str:
         raise ValueError("Database connection string not found in environment variables")
 
+    conn = None
     try:
         # Create a new database session
         conn = psycopg2.connect(conn_str)
-        cur = conn.cursor()
 
-        # Check if the table already exists
-        table_name = 'deals'
-        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = %s);", (table_name,))
-        result = cur.fetchone()
-        table_exists = result[0] if result else False
+        # Clean and load each chunk as it is read so memory stays flat
+        total_rows, total_elapsed = 0, 0.0
+        counts = {'inserted': 0, 'updated': 0, 'skipped': 0, 'missing_key': 0}
+        for i, chunk in enumerate(read_chunks(excel_file_path)):
+            chunk = clean_chunk(chunk, excel_file_identifier)
+            if i == 0:
+                column_types = ensure_table(conn, table_name, chunk, incremental)
+            chunk, lost = coerce_chunk(chunk, column_types)
+            for col in [col for col in lost if col in REPORT_TYPED_COLUMNS]:
+                print(f"Warning: {lost.pop(col)} values in {col} are not {column_types[col]} and were loaded as NULL")
+            if lost:
+                widen_columns(conn, table_name, lost, column_types)
+            total_rows += len(chunk)
 
-        if not table_exists:
-            # Construct the column definitions for the CREATE TABLE statement
-            column_definitions = ", ".join([f"{col} TEXT" for col in df.columns])
-            create_table_statement = f"CREATE TABLE {table_name} ({column_definitions})"
-            cur.execute(create_table_statement)
-            conn.commit()
-            print(f"Table {table_name} created")
+            start = time.perf_counter()
+            if incremental:
+                chunk, missing_key = prepare_incremental(chunk, column_types)
+                inserted, updated, skipped = upsert_chunk(conn, chunk, table_name)
+                counts['inserted'] += inserted
+                counts['updated'] += updated
+                counts['skipped'] += skipped
+                counts['missing_key'] += missing_key
+            else:
+                bulk_insert(conn, chunk, table_name)
+                counts['inserted'] += len(chunk)
+            total_elapsed += time.perf_counter() - start
+            print(f"Loaded {total_rows} rows")
 
-        # Inserting data into the table
-        column_names = ', '.join(df.columns)
-        placeholders = ', '.join(['%s'] * len(df.columns))
-        insert_statement = f"INSERT INTO {table_name} ({column_names}) VALUES ({placeholders})"
-        for _, row in df.iterrows():
-            cur.execute(insert_statement, tuple(row))
- 
-        conn.commit()
+        rows_per_sec = total_rows / total_elapsed if total_elapsed > 0 else float('inf')
+        print(f"Processed {total_rows} rows in {total_elapsed:.2f}s ({rows_per_sec:,.0f} rows/sec, method={LOAD_METHOD})")
+        print(f"Inserted {counts['inserted']}, updated {counts['updated']}, skipped {counts['skipped']} unchanged rows")
+        if counts['missing_key']:
+            print(f"Not loaded: {counts['missing_key']} rows without a full key ({', '.join(KEY_COLUMNS)})")
         print("Data successfully inserted into the database")
 
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
         # Close communication with the database
-        if cur is not None:
-            cur.close()
         if conn is not None:
             conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
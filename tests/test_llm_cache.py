@@ -0,0 +1,99 @@
+import os
+import json
+import glob
+import time
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_cache import cache_key, cached_chat_completion
+
+MESSAGES = [{"role": "user", "content": "Summarize the results"}]
+
+class FakeClient:
+    # Stands in for OpenAI(): answers with a counter so every API call is distinguishable
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **params):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(self.delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f" answer {call} "))])
+
+def entry_path(cache_dir, messages=MESSAGES, model="gpt-4", **params):
+    return os.path.join(cache_dir, f"{cache_key(model, messages, params)}.json")
+
+def test_cache_hit(tmp_path):
+    client = FakeClient()
+    first = cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path))
+    second = cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path))
+    assert first == second == "answer 1"
+    assert client.calls == 1
+
+def test_key_includes_model_and_params(tmp_path):
+    client = FakeClient()
+    cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path))
+    cached_chat_completion(client, "gpt-4-turbo", MESSAGES, cache_dir=str(tmp_path))
+    cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path), temperature=0)
+    assert client.calls == 3
+
+def test_ttl_expiry(tmp_path):
+    client = FakeClient()
+    cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path), ttl=60)
+
+    path = entry_path(str(tmp_path))
+    with open(path) as f:
+        entry = json.load(f)
+    entry['created'] -= 120
+    with open(path, 'w') as f:
+        json.dump(entry, f)
+
+    assert cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path), ttl=60) == "answer 2"
+    assert client.calls == 2
+    # The refreshed answer is served again
+    assert cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path), ttl=60) == "answer 2"
+    assert client.calls == 2
+
+def test_bypass_refreshes_entry(tmp_path):
+    client = FakeClient()
+    cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path))
+    assert cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path), bypass=True) == "answer 2"
+    assert cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path)) == "answer 2"
+    assert client.calls == 2
+
+def test_size_eviction_drops_least_recently_used(tmp_path):
+    client = FakeClient()
+    prompts = [[{"role": "user", "content": f"prompt {i}"}] for i in range(3)]
+    for messages in prompts[:2]:
+        cached_chat_completion(client, "gpt-4", messages, cache_dir=str(tmp_path))
+    entry_size = os.path.getsize(entry_path(str(tmp_path), prompts[0]))
+    # prompt 0 was used least recently
+    os.utime(entry_path(str(tmp_path), prompts[0]), (1000, 1000))
+    os.utime(entry_path(str(tmp_path), prompts[1]), (2000, 2000))
+
+    # Entries differ by a few bytes (the timestamp's repr), so leave slack for two but not three
+    cached_chat_completion(client, "gpt-4", prompts[2], cache_dir=str(tmp_path), max_bytes=2 * entry_size + entry_size // 2)
+
+    assert not os.path.exists(entry_path(str(tmp_path), prompts[0]))
+    assert os.path.exists(entry_path(str(tmp_path), prompts[1]))
+    assert os.path.exists(entry_path(str(tmp_path), prompts[2]))
+
+def test_concurrent_identical_prompts(tmp_path):
+    # Identical prompts from many threads all miss at once and write the same entry
+    client = FakeClient(delay=0.01)
+
+    def complete(_):
+        return cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path), bypass=True)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        answers = list(executor.map(complete, range(160)))
+
+    assert all(answer.startswith("answer ") for answer in answers)
+    assert client.calls == 160
+    assert glob.glob(os.path.join(str(tmp_path), "*.tmp")) == []
+    assert cached_chat_completion(client, "gpt-4", MESSAGES, cache_dir=str(tmp_path)) in answers
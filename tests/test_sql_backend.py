@@ -0,0 +1,41 @@
+import pytest
+
+# Needs the report dependencies and an embedded SQL engine
+pd = pytest.importorskip("pandas")
+pytest.importorskip("duckdb_engine")
+
+import numpy as np
+from sqlalchemy import create_engine
+
+from benchmark import generate_deals
+from data_processing import coerce_metrics, get_results, get_results_sql
+
+def load_deals(engine, n_rows):
+    # Two source files in one typed table, so the source_file filter is exercised too
+    frames = {}
+    for seed, source_file in enumerate(['test_1', 'test_2'], start=1):
+        df = coerce_metrics(generate_deals(n_rows, seed=seed))
+        # Company ids restart per generated table; keep them apart so runway partitions match
+        df['company_id'] = source_file + '_' + df['company_id']
+        frames[source_file] = df.assign(source_file=source_file)
+    pd.concat(frames.values(), ignore_index=True).to_sql('deals', engine, index=False)
+    return frames
+
+def assert_same_table(exact, sql):
+    # Tables can repeat column names (post_valuation), so compare by position
+    assert list(sql.index) == list(exact.index)
+    assert len(sql.columns) == len(exact.columns)
+    np.testing.assert_allclose(sql.to_numpy(dtype=float), exact.to_numpy(dtype=float), rtol=1e-9, equal_nan=True)
+
+@pytest.mark.parametrize('source_files', ['test_1', ['test_1', 'test_2']])
+def test_sql_backend_matches_pandas(source_files):
+    engine = create_engine("duckdb:///:memory:")
+    frames = load_deals(engine, 5_000)
+    names = [source_files] if isinstance(source_files, str) else source_files
+    df = pd.concat([frames[name] for name in names], ignore_index=True)
+
+    exact_1, exact_2 = get_results(df, use_cache=False)
+    sql_1, sql_2 = get_results_sql(engine, source_files=source_files, table_name='deals')
+
+    assert_same_table(exact_1, sql_1)
+    assert_same_table(exact_2, sql_2)
@@ -0,0 +1,53 @@
+import pytest
+
+# Needs the report dependencies (pandas, numpy, data_processing's imports)
+pd = pytest.importorskip("pandas")
+
+import numpy as np
+
+from benchmark import generate_deals
+from data_processing import REPORT_COLUMNS, STREAMING_RELATIVE_ACCURACY, get_results, get_results_streaming
+
+def sorted_deals(n_rows):
+    # Streaming runway needs rows ordered by company and deal number
+    df = generate_deals(n_rows, seed=1)[REPORT_COLUMNS]
+    return df.sort_values(['company_id', 'deal_no_'], ignore_index=True)
+
+def chunked(df, chunk_size):
+    return [df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size)]
+
+def assert_within_accuracy(exact, approx, accuracy):
+    # Tables can repeat column names (post_valuation), so compare by position
+    assert set(approx.index) == set(exact.index)
+    assert len(approx.columns) == len(exact.columns)
+    exact_values = exact.to_numpy(dtype=float)
+    approx_values = approx.reindex(exact.index).to_numpy(dtype=float)
+
+    assert np.array_equal(np.isnan(exact_values), np.isnan(approx_values))
+    known = ~np.isnan(exact_values)
+    error = np.abs(approx_values[known] - exact_values[known])
+    assert np.all(error <= accuracy * np.abs(exact_values[known]) + 1e-12)
+
+@pytest.mark.parametrize('n_rows, chunk_size', [(200_000, 30_000), (2_000, 7)])
+def test_streaming_matches_exact_within_accuracy(n_rows, chunk_size):
+    df = sorted_deals(n_rows)
+    chunks = chunked(df, chunk_size)
+    # Companies must straddle chunk boundaries for the runway carry to be exercised
+    boundaries = np.arange(chunk_size, len(df), chunk_size)
+    assert (df['company_id'].to_numpy()[boundaries - 1] == df['company_id'].to_numpy()[boundaries]).any()
+
+    exact_1, exact_2 = get_results(df, use_cache=False)
+    approx_1, approx_2 = get_results_streaming(chunks, relative_accuracy=STREAMING_RELATIVE_ACCURACY)
+
+    assert_within_accuracy(exact_1, approx_1, STREAMING_RELATIVE_ACCURACY)
+    assert_within_accuracy(exact_2, approx_2, STREAMING_RELATIVE_ACCURACY)
+
+def test_streaming_runway_across_chunk_boundaries():
+    df = sorted_deals(5_000)
+    exact = get_results(df, use_cache=False)[1]['Time to Next Deal']
+    # One chunk, and chunks small enough that most companies are split
+    whole = get_results_streaming(df)[1]['Time to Next Deal']
+    split = get_results_streaming(chunked(df, 3))[1]['Time to Next Deal']
+
+    pd.testing.assert_series_equal(whole, split)
+    assert_within_accuracy(exact.to_frame(), split.to_frame(), STREAMING_RELATIVE_ACCURACY)
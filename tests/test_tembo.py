@@ -0,0 +1,224 @@
+import pytest
+
+# tembo imports the database driver and the workbook reader at module level
+pd = pytest.importorskip("pandas")
+pytest.importorskip("psycopg2")
+pytest.importorskip("openpyxl")
+
+import numpy as np
+
+import tembo
+from tembo import (KEY_COLUMNS, bulk_insert, clean_chunk, coerce_chunk, ensure_table, infer_sql_type,
+                   prepare_incremental, upsert_chunk)
+
+class FakeCursor:
+    # Stands in for a psycopg2 cursor: records statements and COPY payloads on its connection
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, statement, params=None):
+        self.conn.statements.append(" ".join(statement.split()))
+
+    def copy_expert(self, statement, buffer):
+        self.conn.copies.append((statement, buffer.read()))
+
+    def fetchall(self):
+        # Only information_schema.columns is queried with fetchall
+        return list(self.conn.columns.items())
+
+    def fetchone(self):
+        return self.conn.upserted
+
+class FakeConnection:
+    def __init__(self, columns=None, upserted=(0, 0)):
+        # columns: information_schema data types of an existing table
+        self.columns = columns or {}
+        self.upserted = upserted
+        self.statements = []
+        self.copies = []
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+def export_chunk(rows, source_file='test_1'):
+    # Columns as read from the export, before clean_chunk renames them
+    columns = ['Company ID', 'Deal No.', 'Deal Date', 'Deal Size', 'Deal Type', 'Notes']
+    return clean_chunk(pd.DataFrame(rows, columns=columns), source_file)
+
+ROWS = [
+    ['C1', 1, '2020-01-01', 3, 'Seed', 'first'],
+    ['C1', 2, '2021-06-30', 12.5, 'Series A', None],
+    ['C2', 1, '2019-03-15', None, 'Seed', 'note'],
+    ['C3', 1, '2018-11-02', 7, 'Buyout', None],
+]
+
+def test_bulk_insert_copies_each_batch_and_commits():
+    conn = FakeConnection()
+    df = pd.DataFrame({'company_id': [f'C{i}' for i in range(25)], 'deal_size': [float(i) for i in range(24)] + [np.nan]})
+
+    bulk_insert(conn, df, 'deals', batch_size=10, method='copy')
+
+    assert len(conn.copies) == 3
+    assert conn.commits == 3
+    assert all(statement == "COPY deals (company_id, deal_size) FROM STDIN WITH (FORMAT csv)" for statement, _ in conn.copies)
+    lines = "".join(payload for _, payload in conn.copies).splitlines()
+    assert len(lines) == 25
+    # NaN is written as an empty CSV field, which COPY loads as NULL
+    assert lines[-1] == "C24,"
+
+def test_bulk_insert_values_sends_real_nulls(monkeypatch):
+    batches = []
+    monkeypatch.setattr(tembo, 'execute_values', lambda cur, statement, rows, page_size: batches.append((statement, rows)))
+    conn = FakeConnection()
+    df = pd.DataFrame({'company_id': ['C1', 'C2', 'C3'], 'deal_date': pd.to_datetime(['2020-01-01', None, '2021-01-01'])})
+
+    bulk_insert(conn, df, 'deals', batch_size=2, method='values')
+
+    assert [len(rows) for _, rows in batches] == [2, 1]
+    assert batches[0][0] == "INSERT INTO deals (company_id, deal_date) VALUES %s"
+    assert batches[0][1][1] == ('C2', None)
+    assert conn.commits == 2
+
+def test_bulk_insert_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        bulk_insert(FakeConnection(), pd.DataFrame({'a': [1]}), 'deals', method='rows')
+
+def test_ensure_table_creates_typed_table():
+    conn = FakeConnection()
+    column_types = ensure_table(conn, 'deals', export_chunk(ROWS), incremental=True)
+
+    assert column_types['deal_no_'] == 'DOUBLE PRECISION'
+    assert column_types['deal_date'] == 'TIMESTAMP'
+    assert column_types['deal_size'] == 'DOUBLE PRECISION'
+    assert column_types['company_id'] == 'TEXT'
+    assert column_types['row_hash'] == 'BIGINT'
+    create = next(statement for statement in conn.statements if statement.startswith("CREATE TABLE"))
+    assert "deal_date TIMESTAMP" in create
+    assert "row_hash BIGINT" in create
+    assert "loaded_at TIMESTAMP DEFAULT now()" in create
+    assert conn.statements[-1] == f"CREATE UNIQUE INDEX IF NOT EXISTS deals_key ON deals ({', '.join(KEY_COLUMNS)})"
+    assert conn.commits == 1
+
+def test_ensure_table_migrates_legacy_text_table():
+    # An all-TEXT table from before typed columns, without notes and loaded_at
+    legacy = {col: 'text' for col in ['company_id', 'deal_no_', 'deal_date', 'deal_size', 'deal_type', 'source_file']}
+    conn = FakeConnection(columns=legacy)
+    column_types = ensure_table(conn, 'deals', export_chunk(ROWS))
+
+    assert column_types['deal_size'] == 'DOUBLE PRECISION'
+    assert column_types['deal_date'] == 'TIMESTAMP'
+    assert not any(statement.startswith("CREATE TABLE") for statement in conn.statements)
+    assert any(statement.startswith("ALTER TABLE deals ALTER COLUMN deal_size TYPE DOUBLE PRECISION USING CASE") for statement in conn.statements)
+    assert any(statement.startswith("ALTER TABLE deals ALTER COLUMN deal_date TYPE TIMESTAMP USING CASE") for statement in conn.statements)
+    assert "UPDATE deals SET deal_type = NULLIF(deal_type, 'NaT') WHERE deal_type = 'NaT'" in conn.statements
+    assert "ALTER TABLE deals ADD COLUMN notes TEXT" in conn.statements
+    assert "ALTER TABLE deals ADD COLUMN loaded_at TIMESTAMP DEFAULT now()" in conn.statements
+
+def test_coerce_chunk_over_several_chunks():
+    column_types = {col: infer_sql_type(values) for col, values in export_chunk(ROWS).items()}
+    # Later chunks: integers where the first had floats, then values that do not fit the
+    # inferred types of two report columns
+    later = [
+        export_chunk([['C4', 1, '2022-02-02', 4, 'Seed', None]]),
+        export_chunk([['C5', 1, 'unknown', 'n/a', 'Seed', None], ['C6', 2, '2023-01-01', 5.5, 'Seed', None]]),
+    ]
+
+    chunk, lost = coerce_chunk(later[0], column_types)
+    assert lost == {}
+    assert pd.api.types.is_numeric_dtype(chunk['deal_size'])
+    assert pd.api.types.is_datetime64_any_dtype(chunk['deal_date'])
+
+    chunk, lost = coerce_chunk(later[1], column_types)
+    assert lost == {'deal_date': 1, 'deal_size': 1}
+    # Report columns keep their type and the bad values become NULL
+    assert chunk['deal_size'].isna().tolist() == [True, False]
+    assert chunk['deal_date'].isna().tolist() == [True, False]
+
+    # Columns the report does not compute on are left as read for widen_columns
+    chunk, lost = coerce_chunk(later[1].assign(notes=['1', 'x']), dict(column_types, notes='DOUBLE PRECISION'))
+    assert lost['notes'] == 1
+    assert chunk['notes'].tolist() == ['1', 'x']
+
+def hashes_by_key(chunks, column_types):
+    hashes = {}
+    for chunk in chunks:
+        chunk, _ = coerce_chunk(chunk, column_types)
+        chunk, _ = prepare_incremental(chunk, column_types)
+        hashes.update({tuple(key): row_hash for key, row_hash in zip(chunk[KEY_COLUMNS].itertuples(index=False), chunk['row_hash'])})
+    return hashes
+
+def test_row_hash_stable_across_chunk_dtypes_and_boundaries():
+    column_types = {col: infer_sql_type(values) for col, values in export_chunk(ROWS).items()}
+    column_types['row_hash'] = 'BIGINT'
+    # Whole-number deal sizes are int64 in a chunk without fractions and float64 otherwise
+    whole = hashes_by_key([export_chunk(ROWS)], column_types)
+    split = hashes_by_key([export_chunk(ROWS[:1]), export_chunk(ROWS[1:3]), export_chunk(ROWS[3:])], column_types)
+    assert export_chunk(ROWS[3:])['deal_size'].dtype == 'int64'
+    assert whole == split
+
+    # A changed value changes that row's hash only
+    changed_rows = [row[:] for row in ROWS]
+    changed_rows[3][3] = 8
+    changed = hashes_by_key([export_chunk(changed_rows)], column_types)
+    assert changed[('test_1', 'C3', 1)] != whole[('test_1', 'C3', 1)]
+    assert {key: value for key, value in changed.items() if key[1] != 'C3'} == {key: value for key, value in whole.items() if key[1] != 'C3'}
+
+def test_prepare_incremental_drops_missing_keys_and_duplicates():
+    rows = ROWS + [[None, 1, '2020-01-01', 1, 'Seed', None], ['C1', 2, '2021-07-01', 13, 'Series A', 'restated']]
+    chunk = export_chunk(rows)
+    column_types = {col: infer_sql_type(values) for col, values in chunk.items()}
+
+    chunk, missing_key = prepare_incremental(chunk, column_types)
+
+    assert missing_key == 1
+    assert len(chunk) == len(ROWS)
+    # The last copy of a duplicated key wins
+    assert chunk.loc[chunk['company_id'].eq('C1') & chunk['deal_no_'].eq(2), 'notes'].tolist() == ['restated']
+    assert chunk['row_hash'].dtype == 'int64'
+
+def test_upsert_chunk_stages_and_merges():
+    conn = FakeConnection(upserted=(2, 1))
+    chunk = export_chunk(ROWS)
+    column_types = {col: infer_sql_type(values) for col, values in chunk.items()}
+    chunk, _ = prepare_incremental(chunk, column_types)
+
+    inserted, updated, skipped = upsert_chunk(conn, chunk, 'deals', method='copy')
+
+    assert (inserted, updated, skipped) == (2, 1, 1)
+    assert conn.statements[:2] == ["CREATE TEMP TABLE IF NOT EXISTS deals_staging (LIKE deals)", "TRUNCATE deals_staging"]
+    assert conn.copies[0][0].startswith("COPY deals_staging (")
+    merge = conn.statements[-1]
+    assert f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET" in merge
+    assert "WHERE deals.row_hash IS DISTINCT FROM EXCLUDED.row_hash" in merge
+    assert "company_id = EXCLUDED.company_id" not in merge
+    assert "loaded_at = now()" in merge
+
+def test_main_loads_every_chunk(monkeypatch, capsys):
+    conn = FakeConnection()
+    chunks = [pd.DataFrame(ROWS[:2], columns=['Company ID', 'Deal No.', 'Deal Date', 'Deal Size', 'Deal Type', 'Notes']),
+              pd.DataFrame(ROWS[2:], columns=['Company ID', 'Deal No.', 'Deal Date', 'Deal Size', 'Deal Type', 'Notes'])]
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://stand-in')
+    monkeypatch.setattr(tembo.psycopg2, 'connect', lambda conn_str: conn)
+    monkeypatch.setattr(tembo, 'read_chunks', lambda file_path: iter(chunks))
+
+    tembo.main('deals.xlsx', 'test_1', incremental=False)
+
+    output = capsys.readouterr().out
+    assert "An error occurred" not in output
+    assert "Processed 4 rows" in output
+    assert sum(len(payload.splitlines()) for _, payload in conn.copies) == 4
+    assert conn.closed